@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
 import re
 from lxml import etree
 import lxml
@@ -36,62 +35,137 @@ salient_attributes = {
     "type",
     "value",
 }
+ignored_roles = {"presentation", "none", "link"}
+
+# attributes summarised by get_attribute_repr, in output order
+attribute_repr_order = (
+    "role",
+    "aria_role",
+    "type",
+    "alt",
+    "aria_description",
+    "aria_label",
+    "label",
+    "title",
+    "name",
+    "text_value",
+    "value",
+    "placeholder",
+    "input_checked",
+    "input_value",
+    "option_selected",
+    "class",
+)
+ignored_attribute_values = {"hidden", "none", "presentation", "null", "undefined"}
+
+# compiled once and reused, instead of reparsing the expression on every call
+all_nodes_xpath = etree.XPath("//*")
+extra_eol_pattern = re.compile(r"\s{2,}")
+icon_pattern = re.compile(r"\S*icon\S*", re.IGNORECASE)
+text_tag_pattern = re.compile(r"<text>(.*?)</text>")
+# <text> wrappers, closing tags and (self-closing) opening tags in one pass
+bracket_tag_pattern = re.compile(r"<text>(.*?)</text>|</.+?>|<(.+?)(/?)>")
+
+html_escape_table = {
+    "&quot;": '"',
+    "&amp;": "&",
+    "&lt;": "<",
+    "&gt;": ">",
+    "&nbsp;": " ",
+    "&ndash;": "-",
+    "&rsquo;": "'",
+    "&lsquo;": "'",
+    "&ldquo;": '"',
+    "&rdquo;": '"',
+    "&#39;": "'",
+    "&#40;": "(",
+    "&#41;": ")",
+}
+# symbols dropped by clean_element_text
+symbol_table = str.maketrans("", "", ".:/'\",")
+
+# entities after "&amp;" in the table are also decoded when double-escaped
+# (e.g. "&amp;lt;" -> "<"), hence the optional "amp;" in the second branch
+html_escape_pattern = re.compile(
+    r"&quot;|&(?:amp;)?(lt|gt|nbsp|ndash|rsquo|lsquo|ldquo|rdquo|#39|#40|#41);|&amp;"
+)
 
 
 def remove_extra_eol(text):
     # Replace EOL symbols
     text = text.replace("\n", " ")
-    return re.sub(r"\s{2,}", " ", text)
+    return extra_eol_pattern.sub(" ", text)
 
 
 def clean_text(text):
     if text is None:
         return ""
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
+    # split() drops leading/trailing whitespace and collapses the rest in one pass
+    return " ".join(text.split())
 
 
-def get_descendants(node, max_depth, current_depth=0):
-    if current_depth > max_depth:
-        return []
+def get_descendants(node, max_depth, current_depth=0, max_children=None):
     descendants = []
-    for child in node:
+    if current_depth > max_depth:
+        return descendants
+    # iterative pre-order walk, same order as the recursive version
+    stack = [(child, current_depth) for child in reversed(node)]
+    while stack and (max_children is None or len(descendants) < max_children):
+        child, depth = stack.pop()
         descendants.append(child)
-        descendants.extend(get_descendants(child, max_depth, current_depth + 1))
+        if depth < max_depth:
+            stack.extend((grandchild, depth + 1) for grandchild in reversed(child))
     return descendants
 
 
+def clone_tree(tree):
+    # lxml's __copy__ already copies the whole subtree (and tail) inside
+    # libxml2; calling it directly skips copy.deepcopy's memo bookkeeping
+    return tree.__copy__()
+
+
+def reverse_document_order(tree):
+    # children are visited before their parents; the snapshot keeps the walk
+    # stable while callers remove or unwrap nodes
+    return reversed(list(tree.iter(etree.Element)))
+
+
+def index_by_backend_node_id(dom_tree):
+    # map each backend_node_id to its first node in document order
+    id2node = {}
+    for node in dom_tree.iter(etree.Element):
+        backend_node_id = node.get("backend_node_id")
+        if backend_node_id is not None and backend_node_id not in id2node:
+            id2node[backend_node_id] = node
+    return id2node
+
+
 def clean_tree(dom_tree, all_candidate_ids):
-    new_tree = copy.deepcopy(dom_tree)
-    for node in new_tree.xpath("//*")[::-1]:
+    new_tree = clone_tree(dom_tree)
+    for node in reverse_document_order(new_tree):
         # check if node have salient attributes
-        for attr in node.attrib:
-            if attr == "class" and node.attrib[attr] and node.tag == "svg":
-                icon_texts = re.findall(r"\S*icon\S*", node.attrib[attr], re.IGNORECASE)
-                icon_texts = [clean_text(text) for text in icon_texts]
-                icon_texts = [text for text in icon_texts if text]
-                if icon_texts:
-                    node.attrib[attr] = " ".join(icon_texts)
-                else:
-                    node.attrib.pop(attr)
-            elif attr in salient_attributes:
-                if not (
-                    (
-                        attr == "role"
-                        and node.attrib.get(attr, "")
-                        in {"presentation", "none", "link"}
-                    )
-                    or (attr == "type" and node.attrib.get(attr, "") == "hidden")
+        attrib = node.attrib
+        for attr, value in attrib.items():
+            if attr in salient_attributes:
+                if (attr == "role" and value in ignored_roles) or (
+                    attr == "type" and value == "hidden"
                 ):
-                    value = clean_text(node.attrib[attr])
-                    if value != "":
-                        node.attrib[attr] = value
-                    else:
-                        node.attrib.pop(attr)
+                    del attrib[attr]
+                    continue
+                value = clean_text(value)
+                if value != "":
+                    attrib[attr] = value
                 else:
-                    node.attrib.pop(attr)
+                    del attrib[attr]
+            elif attr == "class" and value and node.tag == "svg":
+                # matches never contain whitespace, so they need no cleaning
+                icon_texts = icon_pattern.findall(value)
+                if icon_texts:
+                    attrib[attr] = " ".join(icon_texts)
+                else:
+                    del attrib[attr]
             elif attr != "backend_node_id":
-                node.attrib.pop(attr)
+                del attrib[attr]
         if node.tag == "text":
             value = clean_text(node.text)
             if len(value) > 0:
@@ -112,76 +186,65 @@ def clean_tree(dom_tree, all_candidate_ids):
     return new_tree
 
 
-def prune_tree(
-    dom_tree,
-    candidate_set,
-    max_depth=5,
-    max_children=50,
-    max_sibling=3,
-):
+def get_nodes_to_keep(dom_tree, candidate_set, max_depth, max_children, max_sibling):
+    # backend_node_ids of the candidates and their ancestors, descendants and siblings
     nodes_to_keep = set()
+    id2node = index_by_backend_node_id(dom_tree)
     for candidate_id in candidate_set:
-        candidate_node = dom_tree.xpath(f'//*[@backend_node_id="{candidate_id}"]')[0]
+        candidate_node = id2node[str(candidate_id)]
         nodes_to_keep.add(candidate_node.attrib["backend_node_id"])
         # get all ancestors
         nodes_to_keep.update(
             [
                 x.attrib.get("backend_node_id", "")
-                for x in candidate_node.xpath("ancestor::*")
+                for x in candidate_node.iterancestors()
             ]
         )
         # get descendants with max depth
         nodes_to_keep.update(
             [
                 x.attrib.get("backend_node_id", "")
-                for x in get_descendants(candidate_node, max_depth)
-            ][:max_children]
+                for x in get_descendants(
+                    candidate_node, max_depth, max_children=max_children
+                )
+            ]
         )
         # get siblings within range
         parent = candidate_node.getparent()
         if parent is not None:
-            siblings = [x for x in parent.getchildren() if x.tag != "text"]
-            idx_in_sibling = siblings.index(candidate_node)
-            nodes_to_keep.update(
-                [
-                    x.attrib.get("backend_node_id", "")
-                    for x in siblings[
-                        max(0, idx_in_sibling - max_sibling) : idx_in_sibling
-                        + max_sibling
-                        + 1
+            siblings = []
+            idx_in_sibling = -1
+            for x in parent:
+                if x.tag == "text":
+                    continue
+                if x is candidate_node:
+                    idx_in_sibling = len(siblings)
+                siblings.append(x)
+            # a text candidate is not among the non-text siblings, so it has no sibling range
+            if idx_in_sibling != -1:
+                nodes_to_keep.update(
+                    [
+                        x.attrib.get("backend_node_id", "")
+                        for x in siblings[
+                            max(0, idx_in_sibling - max_sibling) : idx_in_sibling
+                            + max_sibling
+                            + 1
+                        ]
                     ]
-                ]
-            )
-    # clone the tree
-    new_tree = copy.deepcopy(dom_tree)
-    # remove nodes not in nodes_to_keep
-    for node in new_tree.xpath("//*")[::-1]:
-        if node.tag != "text":
-            is_keep = node.attrib.get("backend_node_id", "") in nodes_to_keep
-            is_candidate = node.attrib.get("backend_node_id", "") in candidate_set
-        else:
-            is_keep = (
-                node.getparent().attrib.get("backend_node_id", "") in nodes_to_keep
-            )
-            is_candidate = (
-                node.getparent().attrib.get("backend_node_id", "") in candidate_set
-            )
-        if not is_keep and node.getparent() is not None:
-            node.getparent().remove(node)
-        else:
-            if not is_candidate or node.tag == "text":
-                node.attrib.pop("backend_node_id", None)
-            if (
-                len(node.attrib) == 0
-                and not any([x.tag == "text" for x in node.getchildren()])
-                and node.getparent() is not None
-                and node.tag != "text"
-                and len(node.getchildren()) <= 1
-            ):
-                # insert all children into parent
-                for child in node.getchildren():
-                    node.addprevious(child)
-                node.getparent().remove(node)
+                )
+    return nodes_to_keep
+
+
+def prune_tree(
+    dom_tree,
+    candidate_set,
+    max_depth=5,
+    max_children=50,
+    max_sibling=3,
+):
+    new_tree, _ = data_prune_tree(
+        dom_tree, candidate_set, max_depth, max_children, max_sibling
+    )
     return new_tree
 
 
@@ -192,118 +255,115 @@ def data_prune_tree(
     max_children=50,
     max_sibling=3,
 ):
-    nodes_to_keep = set()
-    for candidate_id in candidate_set:
-        candidate_node = dom_tree.xpath(f'//*[@backend_node_id="{candidate_id}"]')[0]
-        nodes_to_keep.add(candidate_node.attrib["backend_node_id"])
-        # get all ancestors
-        nodes_to_keep.update(
-            [
-                x.attrib.get("backend_node_id", "")
-                for x in candidate_node.xpath("ancestor::*")
-            ]
-        )
-        # get descendants with max depth
-        nodes_to_keep.update(
-            [
-                x.attrib.get("backend_node_id", "")
-                for x in get_descendants(candidate_node, max_depth)
-            ][:max_children]
-        )
-        # get siblings within range
-        parent = candidate_node.getparent()
-        if parent is not None:
-            siblings = [x for x in parent.getchildren() if x.tag != "text"]
-            idx_in_sibling = siblings.index(candidate_node)
-            nodes_to_keep.update(
-                [
-                    x.attrib.get("backend_node_id", "")
-                    for x in siblings[
-                        max(0, idx_in_sibling - max_sibling) : idx_in_sibling
-                        + max_sibling
-                        + 1
-                    ]
-                ]
-            )
+    nodes_to_keep = get_nodes_to_keep(
+        dom_tree, candidate_set, max_depth, max_children, max_sibling
+    )
     # clone the tree
-    new_tree = copy.deepcopy(dom_tree)
+    new_tree = clone_tree(dom_tree)
     # remove nodes not in nodes_to_keep
-    for node in new_tree.xpath("//*")[::-1]:
-        if node.tag != "text":
-            is_keep = node.attrib.get("backend_node_id", "") in nodes_to_keep
-            is_candidate = node.attrib.get("backend_node_id", "") in candidate_set
+    candidate_set = set(candidate_set)
+    for node in reverse_document_order(new_tree):
+        parent = node.getparent()
+        is_text = node.tag == "text"
+        if not is_text:
+            backend_node_id = node.attrib.get("backend_node_id", "")
         else:
-            is_keep = (
-                node.getparent().attrib.get("backend_node_id", "") in nodes_to_keep
-            )
-            is_candidate = (
-                node.getparent().attrib.get("backend_node_id", "") in candidate_set
-            )
-        if not is_keep and node.getparent() is not None:
-            node.getparent().remove(node)
+            backend_node_id = parent.attrib.get("backend_node_id", "")
+        is_keep = backend_node_id in nodes_to_keep
+        is_candidate = backend_node_id in candidate_set
+        if not is_keep and parent is not None:
+            parent.remove(node)
         else:
-            if not is_candidate or node.tag == "text":
+            if not is_candidate or is_text:
                 node.attrib.pop("backend_node_id", None)
             if (
                 len(node.attrib) == 0
-                and not any([x.tag == "text" for x in node.getchildren()])
-                and node.getparent() is not None
-                and node.tag != "text"
-                and len(node.getchildren()) <= 1
+                and not any(child.tag == "text" for child in node)
+                and parent is not None
+                and not is_text
+                and len(node) <= 1
             ):
                 # insert all children into parent
-                for child in node.getchildren():
+                for child in list(node):
                     node.addprevious(child)
-                node.getparent().remove(node)
+                parent.remove(node)
     return new_tree, nodes_to_keep
 
 
-def get_attribute_repr(node, max_value_length=5, max_length=20):
+def get_attribute_meta(node, max_value_length=5, max_length=20):
     # get attribute values in order
+    attrib = node.attrib
     attr_values_set = set()
-    attr_values = ""
-    for attr in [
-        "role",
-        "aria_role",
-        "type",
-        "alt",
-        "aria_description",
-        "aria_label",
-        "label",
-        "title",
-        "name",
-        "text_value",
-        "value",
-        "placeholder",
-        "input_checked",
-        "input_value",
-        "option_selected",
-        "class",
-    ]:
-        if attr in node.attrib and node.attrib[attr] is not None:
-            value = node.attrib[attr].lower()
-            # less menaingful values
-            if value in [
-                "hidden",
-                "none",
-                "presentation",
-                "null",
-                "undefined",
-            ] or value.startswith("http"):
-                continue
-            value = value.split()
-            value = " ".join([v for v in value if len(v) < 15][:max_value_length])
-            if value and value not in attr_values_set:
-                attr_values_set.add(value)
-                attr_values += value + " "
+    attr_values = []
+    for attr in attribute_repr_order:
+        value = attrib.get(attr)
+        if value is None:
+            continue
+        value = value.lower()
+        # less menaingful values
+        if value in ignored_attribute_values or value.startswith("http"):
+            continue
+        value = " ".join([v for v in value.split() if len(v) < 15][:max_value_length])
+        if value and value not in attr_values_set:
+            attr_values_set.add(value)
+            attr_values.append(value)
+    return " ".join(" ".join(attr_values).split()[:max_length])
+
+
+def get_attribute_repr(node, max_value_length=5, max_length=20):
+    meta = get_attribute_meta(node, max_value_length, max_length)
     uid = node.attrib.get("backend_node_id", "")
     # clear all attributes
     node.attrib.clear()
     if uid:
         node.attrib["id"] = uid
     # add meta attribute
-    if attr_values:
-        node.attrib["meta"] = " ".join(attr_values.split()[:max_length])
+    if meta:
+        node.attrib["meta"] = meta
+
+
+def unescape_html_entity(match):
+    if match.group(1) is not None:
+        return html_escape_table[f"&{match.group(1)};"]
+    return html_escape_table[match.group(0)]
+
+
+def rewrite_tag(match):
+    text, tag, self_closing = match.groups()
+    if text is not None:
+        return text
+    if tag is None:
+        return ")"
+    return f"({tag})" if self_closing else f"({tag}"
+
+
+def escape_text(text):
+    # same escaping as etree.tostring for text and tails
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace("\r", "&#13;")
+    )
+
+
+def escape_attribute(value):
+    # same escaping as etree.tostring for attribute values
+    return (
+        escape_text(value)
+        .replace('"', "&quot;")
+        .replace("\n", "&#10;")
+        .replace("\t", "&#9;")
+    )
+
+
+def strip_attribute_syntax(text):
+    return (
+        text.replace('"', " ")
+        .replace("meta= ", "")
+        .replace("id= ", "id=")
+        .replace(" >", ">")
+    )
 
 
 def get_tree_repr(
@@ -311,94 +371,92 @@ def get_tree_repr(
 ):
     if isinstance(tree, str):
         tree = etree.fromstring(tree)
-    else:
-        tree = copy.deepcopy(tree)
-    for node in tree.xpath("//*"):
+    # Emit the representation piece by piece while walking the tree, instead of
+    # copying and rewriting the whole tree and post-processing its serialization.
+    # Each piece is rendered as etree.tostring would serialize it, then given
+    # the quote/attribute-name stripping and bracket rewriting locally.
+    pieces = []
+    stack = [(tree, None)]
+    while stack:
+        node, end_tag = stack.pop()
+        if end_tag is not None:
+            pieces.append(end_tag)
+            if node.tail:
+                pieces.append(strip_attribute_syntax(escape_text(node.tail)))
+            continue
+        if not isinstance(node.tag, str):
+            # comments and processing instructions
+            node_repr = strip_attribute_syntax(
+                etree.tostring(node, encoding="unicode", with_tail=False)
+            )
+            if keep_html_brackets:
+                pieces.append(text_tag_pattern.sub(r"\1", node_repr))
+            else:
+                pieces.append(bracket_tag_pattern.sub(rewrite_tag, node_repr))
+            stack.append((node, ""))
+            continue
+
+        attrib = node.attrib
         if node.tag != "text":
-            if "backend_node_id" in node.attrib:
-                if node.attrib["backend_node_id"] not in id_mapping:
-                    id_mapping[node.attrib["backend_node_id"]] = len(id_mapping)
-                node.attrib["backend_node_id"] = str(
-                    id_mapping[node.attrib["backend_node_id"]]
+            attributes = ""
+            if "backend_node_id" in attrib:
+                new_id = id_mapping.setdefault(
+                    attrib["backend_node_id"], len(id_mapping)
                 )
-            get_attribute_repr(node, max_value_length, max_length)
+                attributes += f' id="{new_id}"'
+            meta = get_attribute_meta(node, max_value_length, max_length)
+            if meta:
+                attributes += f' meta="{escape_attribute(meta)}"'
+            text = node.text
         else:
-            node.text = " ".join(node.text.split()[:max_length])
-    tree_repr = etree.tostring(tree, encoding="unicode")
+            attributes = "".join(
+                f' {name}="{escape_attribute(value)}"' for name, value in attrib.items()
+            )
+            text = " ".join(node.text.split()[:max_length])
+        self_closing = text is None and len(node) == 0
+        start_tag = strip_attribute_syntax(
+            f"<{node.tag}{attributes}{'/>' if self_closing else '>'}"
+        )
 
-    tree_repr = tree_repr.replace('"', " ")
-    tree_repr = (
-        tree_repr.replace("meta= ", "").replace("id= ", "id=").replace(" >", ">")
-    )
-    tree_repr = re.sub(r"<text>(.*?)</text>", r"\1", tree_repr)
-    if not keep_html_brackets:
-        tree_repr = tree_repr.replace("/>", "$/$>")
-        tree_repr = re.sub(r"</(.+?)>", r")", tree_repr)
-        tree_repr = re.sub(r"<(.+?)>", r"(\1", tree_repr)
-        tree_repr = tree_repr.replace("$/$", ")")
-
-    html_escape_table = [
-        ("&quot;", '"'),
-        ("&amp;", "&"),
-        ("&lt;", "<"),
-        ("&gt;", ">"),
-        ("&nbsp;", " "),
-        ("&ndash;", "-"),
-        ("&rsquo;", "'"),
-        ("&lsquo;", "'"),
-        ("&ldquo;", '"'),
-        ("&rdquo;", '"'),
-        ("&#39;", "'"),
-        ("&#40;", "("),
-        ("&#41;", ")"),
-    ]
-    for k, v in html_escape_table:
-        tree_repr = tree_repr.replace(k, v)
-    tree_repr = re.sub(r"\s+", " ", tree_repr).strip()
+        if start_tag == "<text>" and len(node) == 0:
+            # plain text nodes are reduced to their text
+            end_tag = ""
+            start_tag = ""
+        elif keep_html_brackets:
+            end_tag = "" if self_closing else f"</{node.tag}>"
+        elif start_tag.endswith("/>"):
+            end_tag = "" if self_closing else ")"
+            start_tag = f"({start_tag[1:-2]})"
+        else:
+            end_tag = "" if self_closing else ")"
+            start_tag = f"({start_tag[1:-1]}"
+        pieces.append(start_tag)
+        if text:
+            pieces.append(strip_attribute_syntax(escape_text(text)))
+        stack.append((node, end_tag))
+        if len(node):
+            stack.extend((child, None) for child in reversed(node))
+
+    tree_repr = html_escape_pattern.sub(unescape_html_entity, "".join(pieces))
+    tree_repr = " ".join(tree_repr.split())
 
     return tree_repr, id_mapping
 
 
 def extract_elements_from_html(whole_html):
-    pattern = r'<text backend_node_id="(\d+)">(.*?)</text>'
-    all_element_texts = whole_html.strip().split("\n")
-    valids = []
-    invalids = []
-
-    for text in all_element_texts:
-        match = re.search(pattern, text)
-
-        # Extracting the values if a match is found
-        if match:
-            backend_node_id = match.group(1)
-            inner_text = match.group(2)
-            valids.append([backend_node_id, inner_text, text])
-        else:
-            backend_node_id, inner_text = None, None
-            invalids.append(text)
-
     # Using Beautify Soup
     soup = BeautifulSoup(whole_html, "html.parser")
-    # Find all elements and get their tag names
-    tag_names = [tag.name for tag in soup.find_all()]
-
-    # Remove duplicates by converting the list to a set
-    unique_tag_names = set(tag_names)
 
+    # Group elements by tag name in a single pass over the document
     element_dict = {}
-    for tag in unique_tag_names:
-        tag_elements = []
-        elements = soup.find_all(tag)
-        for element in elements:
-            if "backend_node_id" not in element.attrs:
-                continue
-            temp = [element.attrs["backend_node_id"], clean_element_text(element.text)]
-            if "alt" in element.attrs:
-                temp.append(element.attrs["alt"])
-            tag_elements.append(temp)
-            if clean_element_text(element.text) == "":
-                t = element.attrs
-        element_dict[tag] = tag_elements
+    for element in soup.find_all():
+        tag_elements = element_dict.setdefault(element.name, [])
+        if "backend_node_id" not in element.attrs:
+            continue
+        temp = [element.attrs["backend_node_id"], clean_element_text(element.text)]
+        if "alt" in element.attrs:
+            temp.append(element.attrs["alt"])
+        tag_elements.append(temp)
 
     return element_dict
 
@@ -409,17 +467,15 @@ def locate_element_attributes(sample, keep_html_brackets=False):
     tree_repr, backend_node_id2id = get_tree_repr(
         dom_tree, id_mapping={}, keep_html_brackets=keep_html_brackets
     )
-    id2backend_node_id = {}
-    for item in backend_node_id2id:
-        id2backend_node_id[backend_node_id2id[item]] = item
-
-    if isinstance(dom_tree, str):
-        tree = etree.fromstring(dom_tree)
-    else:
-        tree = copy.deepcopy(dom_tree)
+    id2backend_node_id = {
+        new_id: backend_node_id
+        for backend_node_id, new_id in backend_node_id2id.items()
+    }
+
+    # get_tree_repr leaves the parsed tree untouched, so it can be read directly
     # Collect Attributes
     all_node_attributes = []
-    node_to_traverse = tree.xpath("//*")
+    node_to_traverse = all_nodes_xpath(dom_tree)
     for node in node_to_traverse:
         if "backend_node_id" not in node.attrib:
             continue
@@ -437,9 +493,7 @@ def clean_element_text(element_text):
     if not isinstance(element_text, str):
         return ""
     # Remove Symbols
-    symbol_list = [".", ":", "/", "'", '"', ","]
-    for symbol in symbol_list:
-        element_text = element_text.replace(symbol, "")
+    element_text = element_text.translate(symbol_table)
     element_text = element_text.strip()
     # Convert text to lower case for better matching
     element_text = element_text.lower()
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import string
+from functools import lru_cache
+
 import lxml
 from .dom_utils import get_tree_repr, data_prune_tree
 
@@ -30,7 +32,7 @@ def data_format_input_multichoice(
     candidate_nodes = dom_tree.xpath("//*[@backend_node_id]")
     choices = []
     for idx, node in enumerate(candidate_nodes):
-        temp = get_tree_repr(
+        node_repr, id_mapping = get_tree_repr(
             node,
             id_mapping=id_mapping,
             keep_html_brackets=keep_html_brackets,
@@ -38,13 +40,7 @@ def data_format_input_multichoice(
         choices.append(
             [
                 node.attrib["backend_node_id"],
-                " ".join(
-                    get_tree_repr(
-                        node,
-                        id_mapping=id_mapping,
-                        keep_html_brackets=keep_html_brackets,
-                    )[0].split()[:10]
-                ),
+                " ".join(node_repr.split()[:10]),
             ]
         )
     gt = id_mapping.get(gt, -1)
@@ -96,12 +92,9 @@ def generate_query_prompt(
     query_text += "\n\n"
 
     # Previous Actions
-    previous_action_text = "Previous Actions:\n"
-    if previous_actions is None:
-        previous_actions = []
-    for action_text in previous_actions:
-        previous_action_text += action_text
-        previous_action_text += "\n"
+    previous_action_text = "Previous Actions:\n" + "".join(
+        action_text + "\n" for action_text in previous_actions or []
+    )
     query_text += previous_action_text
     query_text += "\n"
 
@@ -110,47 +103,17 @@ def generate_query_prompt(
     return query_text
 
 
-def generate_new_query_prompt(
-    system_prompt="",
-    task="",
-    previous_actions=None,
-    question_description="",
-    original_plan=None,
-    history=None,
-    refined_plan=None,
+def fill_plan_fields(
+    question_description, original_plan=None, history=None, refined_plan=None
 ):
     """
-    Generate the first phase prompt to ask model to generate general descriptions about {environment, high-level plans, next step action}
-    Each experiment will have a similar prompt in this phase
-    This prompt is used to generate models' thoughts without disrupt of formatting/referring prompts
+    Fill the planning/refinement/memory fields of the question description
+    Only the question description is rewritten, never the task or the previous actions
     """
-    sys_role = "" + system_prompt
-    query_text = ""
-
-    # System Prompt
-    query_text += "You are asked to complete the following task: "
-
-    # Task Description
-    query_text += task
-    query_text += "\n\n"
-
-    # Previous Actions
-    previous_action_text = "Previous Actions:\n"
-    if previous_actions is None:
-        previous_actions = []
-    for action_text in previous_actions:
-        previous_action_text += action_text
-        previous_action_text += "\n"
-    query_text += previous_action_text
-    query_text += "\n"
-
-    # Question Description
-    query_text += question_description
-
     # if original plan is than this is the first step and we need to remove all other planning/refinement/memory fields
     if original_plan is None:
-        query_text = (
-            query_text.replace(
+        question_description = (
+            question_description.replace(
                 "\n(History)\nInformation from steps that were already executed.\n", ""
             )
             .replace(
@@ -164,7 +127,7 @@ def generate_new_query_prompt(
         )  # .replace("\n(Relevant information)\nRelevant information from this step. This value will be passed to new steps.\n", "")
 
     else:
-        query_text = query_text.replace(
+        question_description = question_description.replace(
             "\n(Original plan)\nThe high level plan on how the task can be solved, formatted as a list of steps. This will stay the same between execution steps.\n",
             f"\n(Original plan)\n{original_plan}\n" "",
         ).replace(
@@ -174,15 +137,62 @@ def generate_new_query_prompt(
 
     # refinement
     if refined_plan is None:
-        query_text = query_text.replace(
+        question_description = question_description.replace(
             "\n(Refined plan)\nA refined plan after addressing relevant information from previous steps.\n",
             "",
         ).replace("(New refined plan)", "(Refined plan)")
     else:
-        query_text = query_text.replace(
+        question_description = question_description.replace(
             "\n(Refined plan)\nA refined plan after addressing relevant information from previous steps.\n",
             f"\n(Refined plan)\n{refined_plan}\n",
         )
+    return question_description
+
+
+@lru_cache(maxsize=None)
+def get_first_step_question_description(question_description):
+    # Without a plan the filled description only depends on the split, so it is built once
+    return fill_plan_fields(question_description)
+
+
+def generate_new_query_prompt(
+    system_prompt="",
+    task="",
+    previous_actions=None,
+    question_description="",
+    original_plan=None,
+    history=None,
+    refined_plan=None,
+):
+    """
+    Generate the first phase prompt to ask model to generate general descriptions about {environment, high-level plans, next step action}
+    Each experiment will have a similar prompt in this phase
+    This prompt is used to generate models' thoughts without disrupt of formatting/referring prompts
+    """
+    sys_role = "" + system_prompt
+    query_text = ""
+
+    # System Prompt
+    query_text += "You are asked to complete the following task: "
+
+    # Task Description
+    query_text += task
+    query_text += "\n\n"
+
+    # Previous Actions
+    previous_action_text = "Previous Actions:\n" + "".join(
+        action_text + "\n" for action_text in previous_actions or []
+    )
+    query_text += previous_action_text
+    query_text += "\n"
+
+    # Question Description
+    if original_plan is None and refined_plan is None:
+        query_text += get_first_step_question_description(question_description)
+    else:
+        query_text += fill_plan_fields(
+            question_description, original_plan, history, refined_plan
+        )
     return [sys_role, query_text]
 
 
@@ -225,62 +235,76 @@ def generate_referring_prompt(
     return referring_prompt
 
 
-def generate_new_referring_prompt(
-    referring_description="",
-    element_format="",
-    action_format="",
-    value_format="",
-    choices=None,
-    split="4",
+@lru_cache(maxsize=None)
+def get_referring_parts(
+    referring_description="", element_format="", action_format="", value_format=""
 ):
-    referring_prompt = ""
+    """
+    Build the text around the choices of the referring prompt
+    Only the choices change between steps, so the head and tail of each split are built once
+    """
+    referring_head = ""
 
     # Add description about how to format output
     if referring_description != "":
-        referring_prompt += referring_description
-        referring_prompt += "\n\n"
-
-    # Add element prediction format and choices
+        referring_head += referring_description
+        referring_head += "\n\n"
 
-    # Prepare Option texts
-    # For exp {1, 2, 4}, generate option
-    # For element_atttribute, set options field at None
-    if choices:
-        choice_text = format_options(choices)
-        referring_prompt += choice_text
+    referring_tail = ""
 
+    # Add element prediction format
     if element_format != "":
-        referring_prompt += element_format
-        referring_prompt += "\n\n"
+        referring_tail += element_format
+        referring_tail += "\n\n"
 
     # Format Action Prediction
     if action_format != "":
-        referring_prompt += action_format
-        referring_prompt += "\n\n"
+        referring_tail += action_format
+        referring_tail += "\n\n"
 
     # Format Value Prediction
     if value_format != "":
-        referring_prompt += value_format
-        referring_prompt += ""
+        referring_tail += value_format
+        referring_tail += ""
 
-    return referring_prompt
+    return referring_head, referring_tail
+
+
+def generate_new_referring_prompt(
+    referring_description="",
+    element_format="",
+    action_format="",
+    value_format="",
+    choices=None,
+    split="4",
+):
+    referring_head, referring_tail = get_referring_parts(
+        referring_description, element_format, action_format, value_format
+    )
+
+    # Prepare Option texts
+    # For exp {1, 2, 4}, generate option
+    # For element_atttribute, set options field at None
+    if choices:
+        return referring_head + format_options(choices) + referring_tail
+    return referring_head + referring_tail
 
 
 def format_options(choices):
     option_text = ""
-    abcd = ""
-    non_abcd = ""
 
-    multi_choice = ""
-    for multichoice_idx, choice in enumerate(choices):
-        multi_choice += f"{generate_option_name(multichoice_idx)}. {choice[1]}\n"
-        abcd += f"{generate_option_name(multichoice_idx)}, "
+    multi_choice = "".join(
+        f"{generate_option_name(multichoice_idx)}. {choice[1]}\n"
+        for multichoice_idx, choice in enumerate(choices)
+    )
 
-        non_abcd = generate_option_name(multichoice_idx + 1)
-        scroll = generate_option_name(multichoice_idx + 2)
-        previous_page = generate_option_name(multichoice_idx + 2)
-        back_home = generate_option_name(multichoice_idx + 3)
-        search = generate_option_name(multichoice_idx + 4)
+    # special options follow the last element choice
+    multichoice_idx = len(choices) - 1
+    non_abcd = generate_option_name(multichoice_idx + 1)
+    scroll = generate_option_name(multichoice_idx + 2)
+    previous_page = generate_option_name(multichoice_idx + 2)
+    back_home = generate_option_name(multichoice_idx + 3)
+    search = generate_option_name(multichoice_idx + 4)
 
     multi_choice += f"{non_abcd}. None of the other options match the correct element\n"
     multi_choice += f"{scroll}. Scroll (up or down)\n"
@@ -288,7 +312,6 @@ def format_options(choices):
     multi_choice += f"{back_home}. Go to a specific URL (for example Wikipedia.com)\n"
     multi_choice += f"{search}. Execute a query in a search engine (Google.com)"
 
-    # option_text += abcd
     option_text += f"If none of these elements match your target element, please select {non_abcd}. None of the other options match the correct element. If you want to scroll up or down the page, select {scroll}. Scroll (up or down). If you want to go a different URL such as Google.com, please select {back_home}. Go to a different URL and pass the full URL as the value. If you want to run a query in a search engine, please select {search}. Execute a query in a search engine and pass the query as the value.\n"
 
     option_text += multi_choice + "\n\n"
@@ -296,6 +319,12 @@ def format_options(choices):
 
 
 def generate_option_name(index):
+    if 0 <= index < len(option_names):
+        return option_names[index]
+    return compute_option_name(index)
+
+
+def compute_option_name(index):
     if index < 26:
         return string.ascii_uppercase[index]
     else:
@@ -307,6 +336,9 @@ def generate_option_name(index):
 
 
 def get_index_from_option_name(name):
+    index = option_name_to_index.get(name)
+    if index is not None:
+        return index
     if len(name) == 1:
         return string.ascii_uppercase.index(name)
     elif len(name) == 2:
@@ -315,3 +347,8 @@ def get_index_from_option_name(name):
         return 26 + first_letter_index * 26 + second_letter_index
     else:
         raise Exception("The string should be either 1 or 2 characters long")
+
+
+# every valid option name (A..Z, then AA..ZZ), computed once at import
+option_names = tuple(compute_option_name(index) for index in range(26 + 26 * 26))
+option_name_to_index = {name: index for index, name in enumerate(option_names)}
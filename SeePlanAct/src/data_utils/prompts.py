@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from types import MappingProxyType
+
 from .format_prompt_utils import (
     data_format_input_multichoice,
     format_options,
@@ -31,27 +33,16 @@ value_format = (
     'write "None".'
 )
 
-question_description_new_exp4 = """The screenshot below shows the webpage you see. Follow the following guidance to think step by step before outlining the next action step at the current stage:
-
-(Current Webpage Identification)
-Firstly, think about what the current webpage is.
+# Building blocks shared by the exp2, exp3 and exp4 question descriptions
+question_description_intro = """The screenshot below shows the webpage you see. Follow the following guidance to think step by step before outlining the next action step at the current stage:
 
-(Previous Action Analysis)
-Secondly, combined with the screenshot, analyze each step of the previous action history and their intention one by one. Particularly, pay more attention to the last step, which may be more related to what you should do now as the next step.
+"""
 
-(Screenshot Details Analysis)
-Closely examine the screenshot to check the status of every part of the webpage to understand what you can operate with and what has been set or completed. You should closely examine the screenshot details to see what steps have been completed by previous actions even though you are given the textual previous actions. Because the textual history may not clearly and sufficiently record some effects of previous actions, you should closely evaluate the status of every part of the webpage to understand what you have done.
-
-(Next Action Based on Webpage and Analysis)
-Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation.
-
-To be successful, it is important to follow the following rules: 
-1. You should only issue a valid action given the current observation. 
-2. You should only issue one action at a time"""
+question_description_bbox_intro = """The screenshot below shows the webpage you see. In the screenshot, some red bounding boxes and white-on-black uppercase letters at the bottom left corner of the bounding boxes have been manually added. You should ignore them for now. Follow the following guidance to think step by step before outlining the next action step at the current stage:
 
-question_description_new_exp2 = """The screenshot below shows the webpage you see. In the screenshot, some red bounding boxes and white-on-black uppercase letters at the bottom left corner of the bounding boxes have been manually added. You should ignore them for now. Follow the following guidance to think step by step before outlining the next action step at the current stage:
+"""
 
-(Current Webpage Identification)
+question_description_guidance = """(Current Webpage Identification)
 Firstly, think about what the current webpage is.
 
 (Previous Action Analysis)
@@ -61,71 +52,84 @@ Secondly, combined with the screenshot, analyze each step of the previous action
 Closely examine the screenshot to check the status of every part of the webpage to understand what you can operate with and what has been set or completed. You should closely examine the screenshot details to see what steps have been completed by previous actions even though you are given the textual previous actions. Because the textual history may not clearly and sufficiently record some effects of previous actions, you should closely evaluate the status of every part of the webpage to understand what you have done.
 
 (Next Action Based on Webpage and Analysis)
-Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation.
+Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation."""
 
-To be successful, it is important to follow the following rules: 
-1. You should only issue a valid action given the current observation. 
-2. You should only issue one action at a time."""
+question_description_exp3_target_details = """ Please also closely examine the screenshot to adequately describe its position relative to nearby elements and its textual or visual content (if it has). If you find multiple elements similar to your target element, use a more precise description to ensure people can distinguish your target element from them through your answer."""
 
-question_description_new_exp3 = """The screenshot below shows the webpage you see. Follow the following guidance to think step by step before outlining the next action step at the current stage:
-
-(Current Webpage Identification)
-Firstly, think about what the current webpage is.
+question_description_rules = """
 
-(Previous Action Analysis)
-Secondly, combined with the screenshot, analyze each step of the previous action history and their intention one by one. Particularly, pay more attention to the last step, which may be more related to what you should do now as the next step.
+To be successful, it is important to follow the following rules: 
+1. You should only issue a valid action given the current observation. 
+2. You should only issue one action at a time"""
 
-(Screenshot Details Analysis)
-Closely examine the screenshot to check the status of every part of the webpage to understand what you can operate with and what has been set or completed. You should closely examine the screenshot details to see what steps have been completed by previous actions even though you are given the textual previous actions. Because the textual history may not clearly and sufficiently record some effects of previous actions, you should closely evaluate the status of every part of the webpage to understand what you have done.
+# exp4 has always been sent without the final period of the rules
+question_description_new_exp4 = (
+    question_description_intro
+    + question_description_guidance
+    + question_description_rules
+)
 
-(Next Action Based on Webpage and Analysis)
-Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation. Please also closely examine the screenshot to adequately describe its position relative to nearby elements and its textual or visual content (if it has). If you find multiple elements similar to your target element, use a more precise description to ensure people can distinguish your target element from them through your answer.
+question_description_new_exp2 = (
+    question_description_bbox_intro
+    + question_description_guidance
+    + question_description_rules
+    + "."
+)
 
-To be successful, it is important to follow the following rules: 
-1. You should only issue a valid action given the current observation. 
-2. You should only issue one action at a time."""
+question_description_new_exp3 = (
+    question_description_intro
+    + question_description_guidance
+    + question_description_exp3_target_details
+    + question_description_rules
+    + "."
+)
 
-exp4_prompt_dict = {
-    "system_prompt": sys_prompt,
-    "question_description": question_description_new_exp4,
-    "referring_description": f"""(Reiteration)
+exp4_prompt_dict = MappingProxyType(
+    {
+        "system_prompt": sys_prompt,
+        "question_description": question_description_new_exp4,
+        "referring_description": """(Reiteration)
 First, reiterate your next target element, its detailed location, and the corresponding operation.
 
 (Multichoice Question)
 Below is a multi-choice question, where the choices are elements in the webpage. From the screenshot, find out where and what each one is on the webpage. Then, determine whether one matches your target element. Please examine the choices one by one. Choose the matching one. If multiple options match your answer, choose the most likely one by re-examining the screenshot, the choices, and your further reasoning.""",
-    "element_format": """(Final Answer)
+        "element_format": """(Final Answer)
 Finally, conclude your answer using the format below. Ensure your answer is strictly adhering to the format provided below. Please do not leave any explanation in your answers of the final standardized format part, and this final part should be clear and certain. The element choice, action, and value should be in three separate lines.
 
 Format:
 
 ELEMENT: The uppercase letter of your choice.""",
-    "action_format": f"{action_format}",
-    "value_format": f"{value_format}",
-}
+        "action_format": action_format,
+        "value_format": value_format,
+    }
+)
 
-exp2_prompt_dict = {
-    "system_prompt": sys_prompt,
-    "question_description": question_description_new_exp2,
-    "referring_description": f"""(Reiteration)
+exp2_prompt_dict = MappingProxyType(
+    {
+        "system_prompt": sys_prompt,
+        "question_description": question_description_new_exp2,
+        "referring_description": """(Reiteration)
 First, reiterate your next target element, its detailed location, and the corresponding operation.
 
 (Verification with the Screenshot)
 Then, please closely re-examine the screenshot to find whether your target element is marked by a red bounding box and has a white uppercase letter on a black background at the bottom left corner of the bounding box, which is positioned closely next to the bounding box. If yes, use that letter for your final answer. If not, please do not make them up. If it is not marked, please output "NA" as your target element in the following final answer part.""",
-    "element_format": """(Final Answer)
+        "element_format": """(Final Answer)
 Finally, conclude your answer using the format below. Ensure your answer is strictly adhering to the format provided below. Please do not leave any explanation in your answers of the final standardized format part, and this final part should be clear and certain. The element choice, action, and value should be in three separate lines.
 
 Format:
 
 ELEMENT: The uppercase letter of your choice.""",
-    "action_format": f"{action_format}",
-    "value_format": f"{value_format}",
-}
+        "action_format": action_format,
+        "value_format": value_format,
+    }
+)
 
-exp3_prompt_dict = {
-    "system_prompt": sys_prompt,
-    "question_description": question_description_new_exp3,
-    "referring_description": f"""""",
-    "element_format": """(Final Answer)
+exp3_prompt_dict = MappingProxyType(
+    {
+        "system_prompt": sys_prompt,
+        "question_description": question_description_new_exp3,
+        "referring_description": "",
+        "element_format": """(Final Answer)
 Finally, conclude your answer using the format below. Ensure your answer is strictly adhering to the format provided below. Please do not leave any explanation in your answers of the final standardized format part, and this final part should be clear and certain. The element, element type, element text, action and value should be in five separate lines.
 
 Format:
@@ -135,9 +139,10 @@ ELEMENT: Please describe which element you need to operate with. Describe it as
 ELEMENT TYPE: Please specify its type from these options: BUTTON, TEXTBOX, SELECTBOX, or LINK.
 
 ELEMENT TEXT: Please provide the exact text displayed on the element. Do not invent or modify the text; reproduce it as-is from the screenshot.""",
-    "action_format": f"{action_format}",
-    "value_format": f"{value_format}",
-}
+        "action_format": action_format,
+        "value_format": value_format,
+    }
+)
 
 
 ##### SeeAct_ori Online Prompts
@@ -163,6 +168,43 @@ To be successful, it is important to follow the following rules:
 2. You should only issue one action at a time
 3. For handling the select dropdown elements on the webpage, it's not necessary for you to provide completely accurate options right now. The full list of options for these elements will be supplied later."""
 
+# SeeAct online prompts extended with the planning, history and refinement fields
+seeact_online_plan_sys_prompt = """Imagine that you are imitating humans doing web navigation for a task step by step. At each stage, you can see the webpage like humans by a screenshot and know the previous actions before the current step decided by yourself through recorded history. You need to decide on the first following action to take. You can click on an element with the mouse, select an option, type text, press Enter with the keyboard, scroll up and down, go back to the previous page, or go to a different URL (For your understanding, they are like the click(), select_option(), type(), keyboard.press('Enter'), window.scrollBy(), page.goBack(), page.goto() functions in playwright respectively). One next step means one operation. You are also given the option to go to a search engine (Google) and execute a query in one operation. Unlike humans, for typing (e.g., in text areas, text boxes) and selecting (e.g., from dropdown menus or <select> elements), you should try directly typing the input or selecting the choice, bypassing the need for an initial click. You should not attempt to create accounts, log in or do the final submission. Terminate when you deem the task complete or if it requires potentially harmful actions."""
+
+seeact_online_plan_question_description = """The screenshot below shows the webpage you see. Follow the following guidance to think step by step before outlining the next action step at the current stage:
+
+(Original plan)
+The high level plan on how the task can be solved, formatted as a list of steps. This will stay the same between execution steps.
+
+(History)
+Information from steps that were already executed.
+
+(Refined plan)
+A refined plan after addressing relevant information from previous steps.
+ 
+(Current Webpage Identification)
+Firstly, think about what the current webpage is.
+
+(Previous Action Analysis)
+Secondly, combined with the screenshot, analyze each step of the previous action history and their intention one by one. Particularly, pay more attention to the last step, which may be more related to what you should do now as the next step. Specifically, if the last action involved a TYPE, always evaluate whether it necessitates a confirmation step, because typically a single TYPE action does not make effect. (often, simply pressing 'Enter', assuming the default element involved in the last action, unless other clear elements are present for operation).
+
+(Screenshot Details Analysis)
+Closely examine the screenshot to check the status of every part of the webpage to understand what you can operate with and what has been set or completed. You should closely examine the screenshot details to see what steps have been completed by previous actions even though you are given the textual previous actions. Because the textual history may not clearly and sufficiently record some effects of previous actions, you should closely evaluate the status of every part of the webpage to understand what you have done.
+
+(Relevant information)
+Relevant information that from the webpage to perform the task. Make sure this information can be understood from the webpage. This information will be passed to the next steps. If the webpage does not display any information to perform the task, say "no new infromation". You can use the next steps to find more information or verify information you are unsure of. 
+
+(New refined plan)
+A refined plan on how to solve the task that will be passed to next steps. If the original task has been completed, say: "Terminating, the task has been completed". If the task required finding information in the web, add: "Task answer:" followed by the relevant information. Keep the answer as concise as possible. The answer should either be: a number, a string, a list of strings, or a list of jsons. The answer should be parsed with the python method: json.loads(input_str). If no answer is found, generate an empty string.
+
+(Next Action Based on Webpage and Analysis)
+Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation. If you require searching or verifying information you can use the web, for example Google.
+
+To be successful, it is important to follow the following rules: 
+1. You should only issue a valid action given the current observation. 
+2. You should only issue one action at a time
+3. For handling the select dropdown elements on the webpage, it's not necessary for you to provide completely accurate options right now. The full list of options for these elements will be supplied later."""
+
 seeact_online_action_format = "ACTION: Choose an action from {CLICK, SELECT, TYPE, GOTO, SEARCH, GOBACK, SCROLL, PRESS ENTER, TERMINATE, NONE}."
 
 seeact_online_value_format = (
@@ -171,22 +213,51 @@ seeact_online_value_format = (
     'write "None".'
 )
 
-seeact_choice_prompt_dict = {
-    "system_prompt": seeact_online_sys_prompt,
-    "question_description": seeact_online_question_description_new_exp4,
-    "referring_description": f"""(Reiteration)
+seeact_choice_prompt_dict = MappingProxyType(
+    {
+        "system_prompt": seeact_online_sys_prompt,
+        "question_description": seeact_online_question_description_new_exp4,
+        "referring_description": """(Reiteration)
 First, reiterate your next target element, its detailed location, and the corresponding operation.
 
 (Multichoice Question)
 Below is a multi-choice question, where the choices are elements in the webpage. All elements are arranged in the order based on their height on the webpage, from top to bottom (and from left to right). This arrangement can be used to locate them. From the screenshot, find out where and what each one is on the webpage, taking into account both their text content and HTML details. Then, determine whether one matches your target element. Please examine the choices one by one. Choose the matching one. If multiple options match your answer, choose the most likely one by re-examining the screenshot, the choices, and your further reasoning.""",
-    "element_format": """(Final Answer)
+        "element_format": """(Final Answer)
 Finally, conclude your answer using the format below. Ensure your answer is strictly adhering to the format provided below. Please do not leave any explanation in your answers of the final standardized format part, and this final part should be clear and certain. The element choice, action, and value should be in three separate lines.
 
 Format:
 
 ELEMENT: The uppercase letter of your choice. (No need for PRESS ENTER)""",
-    "action_format": f"{seeact_online_action_format}",
-    "value_format": f"{seeact_online_value_format}",
+        "action_format": seeact_online_action_format,
+        "value_format": seeact_online_value_format,
+    }
+)
+
+seeact_online_plan_prompt_dict = MappingProxyType(
+    {
+        "system_prompt": seeact_online_plan_sys_prompt,
+        "question_description": seeact_online_plan_question_description,
+        "referring_description": seeact_choice_prompt_dict["referring_description"],
+        "element_format": seeact_choice_prompt_dict["element_format"],
+        "action_format": seeact_choice_prompt_dict["action_format"],
+        "value_format": seeact_choice_prompt_dict["value_format"],
+    }
+)
+
+# Prompt dict for each experiment split alias, and whether it is given the
+# candidate choices (3api answers free-form, 2api refers to the screenshot)
+experiment_split_prompts = {
+    "text": (exp4_prompt_dict, True),
+    "text_choice": (exp4_prompt_dict, True),
+    "4api": (exp4_prompt_dict, True),
+    "element_attributes": (exp3_prompt_dict, False),
+    "3api": (exp3_prompt_dict, False),
+    "image_annotation": (exp2_prompt_dict, False),
+    "2api": (exp2_prompt_dict, False),
+    "seeact_online": (seeact_online_plan_prompt_dict, True),
+    "online": (seeact_online_plan_prompt_dict, True),
+    "seeact": (seeact_online_plan_prompt_dict, True),
+    "SeeAct": (seeact_online_plan_prompt_dict, True),
 }
 
 
@@ -203,153 +274,85 @@ def generate_prompt(
     assert task != None, "Please input the task."
     assert previous != None, "Please input the previous actions."
 
-    prompt_list = []
-    system_prompt_input = None
-    question_description_input = None
-    referring_input = None
-    element_format_input = None
-    action_format_input = None
-    value_format_input = None
-
-    if experiment_split in ["text", "text_choice", "4api"]:
-        system_prompt_input = exp4_prompt_dict["system_prompt"]
-        question_description_input = exp4_prompt_dict["question_description"]
-        referring_input = exp4_prompt_dict["referring_description"]
-        element_format_input = exp4_prompt_dict["element_format"]
-        action_format_input = exp4_prompt_dict["action_format"]
-        value_format_input = exp4_prompt_dict["value_format"]
-
-        prompt_list.extend(
-            generate_new_query_prompt(
-                system_prompt=system_prompt_input,
-                task=task,
-                previous_actions=previous,
-                question_description=question_description_input,
-            )
-        )
-        prompt_list.append(
-            generate_new_referring_prompt(
-                referring_description=referring_input,
-                element_format=element_format_input,
-                action_format=action_format_input,
-                value_format=value_format_input,
-                choices=choices,
-            )
+    split_prompt = experiment_split_prompts.get(experiment_split)
+    if split_prompt is None:
+        return None
+    prompt_dict, use_choices = split_prompt
+
+    # The plan fields only appear in the SeeAct online question description,
+    # for the other splits filling them leaves the description unchanged
+    prompt_list = generate_new_query_prompt(
+        system_prompt=prompt_dict["system_prompt"],
+        task=task,
+        previous_actions=previous,
+        question_description=prompt_dict["question_description"],
+        original_plan=original_plan,
+        history=history,
+        refined_plan=refined_plan,
+    )
+    prompt_list.append(
+        generate_new_referring_prompt(
+            referring_description=prompt_dict["referring_description"],
+            element_format=prompt_dict["element_format"],
+            action_format=prompt_dict["action_format"],
+            value_format=prompt_dict["value_format"],
+            choices=choices if use_choices else None,
         )
-        return prompt_list
-
-    elif experiment_split in ["element_attributes", "3api"]:
-        system_prompt_input = exp3_prompt_dict["system_prompt"]
-        question_description_input = exp3_prompt_dict["question_description"]
-        referring_input = exp3_prompt_dict["referring_description"]
-        element_format_input = exp3_prompt_dict["element_format"]
-        action_format_input = exp3_prompt_dict["action_format"]
-        value_format_input = exp3_prompt_dict["value_format"]
-
-        prompt_list.extend(
-            generate_new_query_prompt(
-                system_prompt=system_prompt_input,
-                task=task,
-                previous_actions=previous,
-                question_description=question_description_input,
-            )
-        )
-        prompt_list.append(
-            generate_new_referring_prompt(
-                referring_description=referring_input,
-                element_format=element_format_input,
-                action_format=action_format_input,
-                value_format=value_format_input,
-                split="3api",
-            )
-        )
-        return prompt_list
-
-    elif experiment_split in ["image_annotation", "2api"]:
-        system_prompt_input = exp2_prompt_dict["system_prompt"]
-        question_description_input = exp2_prompt_dict["question_description"]
-        referring_input = exp2_prompt_dict["referring_description"]
-        element_format_input = exp2_prompt_dict["element_format"]
-        action_format_input = exp2_prompt_dict["action_format"]
-        value_format_input = exp2_prompt_dict["value_format"]
-
-        prompt_list.extend(
-            generate_new_query_prompt(
-                system_prompt=system_prompt_input,
-                task=task,
-                previous_actions=previous,
-                question_description=question_description_input,
-            )
-        )
-        prompt_list.append(
-            generate_new_referring_prompt(
-                referring_description=referring_input,
-                element_format=element_format_input,
-                action_format=action_format_input,
-                value_format=value_format_input,
-                choices=None,
-            )
-        )
-        return prompt_list
-    elif experiment_split in ["seeact_online", "online", "seeact", "SeeAct"]:
-        system_prompt_input = """Imagine that you are imitating humans doing web navigation for a task step by step. At each stage, you can see the webpage like humans by a screenshot and know the previous actions before the current step decided by yourself through recorded history. You need to decide on the first following action to take. You can click on an element with the mouse, select an option, type text, press Enter with the keyboard, scroll up and down, go back to the previous page, or go to a different URL (For your understanding, they are like the click(), select_option(), type(), keyboard.press('Enter'), window.scrollBy(), page.goBack(), page.goto() functions in playwright respectively). One next step means one operation. You are also given the option to go to a search engine (Google) and execute a query in one operation. Unlike humans, for typing (e.g., in text areas, text boxes) and selecting (e.g., from dropdown menus or <select> elements), you should try directly typing the input or selecting the choice, bypassing the need for an initial click. You should not attempt to create accounts, log in or do the final submission. Terminate when you deem the task complete or if it requires potentially harmful actions."""
-        question_description_input = """The screenshot below shows the webpage you see. Follow the following guidance to think step by step before outlining the next action step at the current stage:
+    )
+    return prompt_list
 
-(Original plan)
-The high level plan on how the task can be solved, formatted as a list of steps. This will stay the same between execution steps.
 
-(History)
-Information from steps that were already executed.
-
-(Refined plan)
-A refined plan after addressing relevant information from previous steps.
- 
-(Current Webpage Identification)
-Firstly, think about what the current webpage is.
-
-(Previous Action Analysis)
-Secondly, combined with the screenshot, analyze each step of the previous action history and their intention one by one. Particularly, pay more attention to the last step, which may be more related to what you should do now as the next step. Specifically, if the last action involved a TYPE, always evaluate whether it necessitates a confirmation step, because typically a single TYPE action does not make effect. (often, simply pressing 'Enter', assuming the default element involved in the last action, unless other clear elements are present for operation).
-
-(Screenshot Details Analysis)
-Closely examine the screenshot to check the status of every part of the webpage to understand what you can operate with and what has been set or completed. You should closely examine the screenshot details to see what steps have been completed by previous actions even though you are given the textual previous actions. Because the textual history may not clearly and sufficiently record some effects of previous actions, you should closely evaluate the status of every part of the webpage to understand what you have done.
-
-(Relevant information)
-Relevant information that from the webpage to perform the task. Make sure this information can be understood from the webpage. This information will be passed to the next steps. If the webpage does not display any information to perform the task, say "no new infromation". You can use the next steps to find more information or verify information you are unsure of. 
-
-(New refined plan)
-A refined plan on how to solve the task that will be passed to next steps. If the original task has been completed, say: "Terminating, the task has been completed". If the task required finding information in the web, add: "Task answer:" followed by the relevant information. Keep the answer as concise as possible. The answer should either be: a number, a string, a list of strings, or a list of jsons. The answer should be parsed with the python method: json.loads(input_str). If no answer is found, generate an empty string.
-
-(Next Action Based on Webpage and Analysis)
-Then, based on your analysis, in conjunction with human web browsing habits and the logic of web design, decide on the following action. And clearly outline which element in the webpage users will operate with as the first next target element, its detailed location, and the corresponding operation. If you require searching or verifying information you can use the web, for example Google.
-
-To be successful, it is important to follow the following rules: 
-1. You should only issue a valid action given the current observation. 
-2. You should only issue one action at a time
-3. For handling the select dropdown elements on the webpage, it's not necessary for you to provide completely accurate options right now. The full list of options for these elements will be supplied later."""  # seeact_choice_prompt_dict["question_description"]
-        referring_input = seeact_choice_prompt_dict["referring_description"]
-        element_format_input = seeact_choice_prompt_dict["element_format"]
-        action_format_input = seeact_choice_prompt_dict["action_format"]
-        value_format_input = seeact_choice_prompt_dict["value_format"]
-        prompt_list = []
-
-        prompt_list.extend(
-            generate_new_query_prompt(
-                system_prompt=system_prompt_input,
-                task=task,
-                previous_actions=previous,
-                question_description=question_description_input,
-                original_plan=original_plan,
-                history=history,
-                refined_plan=refined_plan,
-            )
+def generate_prompt_batch(
+    experiment_split,
+    tasks,
+    previous_list,
+    choices_list=None,
+    original_plans=None,
+    histories=None,
+    refined_plans=None,
+):
+    """
+    Generate the prompts of several steps at once, e.g. for offline runs whose requests are sent together to a batch inference endpoint
+    The i-th prompt is generate_prompt(experiment_split, tasks[i], previous_list[i], ...), missing lists default to None for every step
+    """
+    num_steps = len(tasks)
+    assert (
+        len(previous_list) == num_steps
+    ), "Please input the previous actions of every task."
+    if choices_list is None:
+        choices_list = [None] * num_steps
+    if original_plans is None:
+        original_plans = [None] * num_steps
+    if histories is None:
+        histories = [None] * num_steps
+    if refined_plans is None:
+        refined_plans = [None] * num_steps
+    assert (
+        len(choices_list) == num_steps
+    ), "Please input the choices of every task."
+    assert (
+        len(original_plans) == num_steps
+    ), "Please input the original plan of every task."
+    assert len(histories) == num_steps, "Please input the history of every task."
+    assert (
+        len(refined_plans) == num_steps
+    ), "Please input the refined plan of every task."
+    return [
+        generate_prompt(
+            experiment_split,
+            task=task,
+            previous=previous,
+            choices=choices,
+            original_plan=original_plan,
+            history=history,
+            refined_plan=refined_plan,
         )
-        prompt_list.append(
-            generate_new_referring_prompt(
-                referring_description=referring_input,
-                element_format=element_format_input,
-                action_format=action_format_input,
-                value_format=value_format_input,
-                choices=choices,
-            )
+        for task, previous, choices, original_plan, history, refined_plan in zip(
+            tasks,
+            previous_list,
+            choices_list,
+            original_plans,
+            histories,
+            refined_plans,
         )
-        return prompt_list
+    ]
@@ -531,6 +531,41 @@ async def get_interactive_elements_with_playwright(page, clip=None):
     return interactive_elements
 
 
+# Full scrollable height of the page, used to place the screenshot clip
+page_total_height_js = """() => {
+    return Math.max(
+        document.documentElement.scrollHeight,
+        document.body.scrollHeight,
+        document.documentElement.clientHeight
+    );
+}"""
+
+
+# Fingerprint of the markup, form values, scroll position, viewport and URL of a page. It does not cover
+# computed styles (:hover/:focus menus, transitions, resized images), which also decide what
+# get_interactive_elements_with_playwright returns, see get_interactive_elements_cached
+page_state_digest_js = """() => {
+    const parts = [location.href, window.scrollX, window.scrollY, window.innerWidth, window.innerHeight];
+    for (const element of document.querySelectorAll("input, textarea, select")) {
+        parts.push(element.value, element.checked);
+    }
+    const text = document.documentElement.outerHTML + "\\u0000" + parts.join("\\u0000");
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < text.length; i++) {
+        hash ^= text.charCodeAt(i);
+        hash = Math.imul(hash, 0x01000193);
+    }
+    return text.length + "_" + (hash >>> 0);
+}"""
+
+
+async def get_page_state_digest(page):
+    try:
+        return await page.evaluate(page_state_digest_js)
+    except Exception as e:
+        return None
+
+
 async def select_option(selector, value):
     best_option = [-1, "", -1]
     for i in range(await selector.locator("option").count()):
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import re
+from functools import lru_cache
 
 prompt_dict = {
     "default_prompt": """/*
@@ -144,22 +145,20 @@ def format_ranking_input(elements, task, previous_actions):
 def format_choices(elements, candidate_ids, objective, taken_actions):
     prompt_template = llm_prompt
 
-    converted_elements = [
-        (
-            f'<{element[2]} id="{i}">'
-            + (
-                element[1]
-                if len(element[1].split()) < 30
-                else " ".join(element[1].split()[:30]) + "..."
+    # only the candidates are converted, not every element of the page
+    choices = []
+    for i in candidate_ids:
+        element = elements[i]
+        if element[2] != "select":
+            words = element[1].split()
+            description = (
+                element[1] if len(words) < 30 else " ".join(words[:30]) + "..."
             )
-            + f"</{element[-1]}>"
-            if element[2] != "select"
-            else f'<{element[2]} id="{i}">' + (element[1]) + f"</{element[-1]}>"
+        else:
+            description = element[1]
+        choices.append(
+            [str(i), f'<{element[2]} id="{i}">' + description + f"</{element[-1]}>"]
         )
-        for i, element in enumerate(elements)
-    ]
-
-    choices = [[str(i), converted_elements[i]] for i in candidate_ids]
 
     return choices
 
@@ -193,6 +192,8 @@ def postprocess_action_llm(text):
     return selected_option, action.strip(), value.strip()
 
 
+# returns a tuple of strings, so a repeated grounding output can share the parsed result
+@lru_cache(maxsize=1024)
 def postprocess_action_lmm(text):
     text = text.strip()
     text = text.replace(
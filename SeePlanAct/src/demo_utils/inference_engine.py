@@ -26,6 +26,9 @@ from openai.error import (
 )
 
 import base64
+import hashlib
+import shelve
+from collections import OrderedDict
 from copy import deepcopy
 import boto3
 
@@ -58,6 +61,9 @@ class OpenaiEngine(Engine):
             rate_limit=-1,
             model=None,
             temperature=0,
+            prompt_cache=False,
+            response_cache_size=128,
+            response_cache_path=None,
             **kwargs,
     ) -> None:
         """Init an OpenAI GPT/Codex engine
@@ -67,6 +73,9 @@ class OpenaiEngine(Engine):
             stop (list, optional): Tokens indicate stop of sequence. Defaults to ["\n"].
             rate_limit (int, optional): Max number of requests per minute. Defaults to -1.
             model (_type_, optional): Model family. Defaults to None.
+            prompt_cache (bool, optional): Send the prompt_cache_key given to generate() to OpenAI. Defaults to False.
+            response_cache_size (int, optional): Number of answers kept for repeated greedy requests, 0 disables it. Defaults to 128.
+            response_cache_path (str, optional): Shelve file that also keeps those answers across runs. Defaults to None.
         """
         assert (
                 os.getenv("OPENAI_API_KEY", api_key) is not None
@@ -82,6 +91,14 @@ class OpenaiEngine(Engine):
         self.stop = stop
         self.temperature = temperature
         self.model = model
+        self.prompt_cache = prompt_cache
+        self.response_cache_size = response_cache_size
+        self.response_cache = OrderedDict()
+        self.response_disk_cache = None
+        # (path, mtime, size) of the last screenshot with its bytes, digest and base64, see read_image
+        self.last_image = None
+        if response_cache_path and response_cache_size > 0:
+            self.response_disk_cache = shelve.open(response_cache_path)
         # convert rate limit to minmum request interval
         self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
         self.next_avil_time = [0] * len(self.api_keys)
@@ -92,12 +109,115 @@ class OpenaiEngine(Engine):
         with open(self, image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
 
+    def read_image(self, image_path):
+        """Bytes, digest and base64 of a screenshot, read from disk and encoded once for both turns of a step"""
+        stat = os.stat(image_path)
+        image_key = (image_path, stat.st_mtime_ns, stat.st_size)
+        if self.last_image is None or self.last_image[0] != image_key:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+            self.last_image = (
+                image_key,
+                image_bytes,
+                hashlib.blake2b(image_bytes, digest_size=16).digest(),
+                base64.b64encode(image_bytes).decode('utf-8'),
+            )
+        return self.last_image[1:]
+
+    def build_messages(self, prompt: list, image_path=None, ouput__0=None, turn_number=0):
+        """Build the chat messages of a turn once, so that retries resend them as is
+
+        Args:
+            prompt (list): System prompt, query prompt and referring prompt from generate_prompt.
+            image_path (str, optional): Screenshot attached to the query prompt. Defaults to None.
+            ouput__0 (str, optional): Model answer of turn 0, only used by turn 1. Defaults to None.
+            turn_number (int, optional): 0 for the query turn, 1 for the referring turn. Defaults to 0.
+        """
+        prompt0 = prompt[0]
+        prompt1 = prompt[1]
+        prompt2 = prompt[2]
+
+        if turn_number not in (0, 1):
+            return None
+
+        if self.model != "claude":
+            base64_image = self.read_image(image_path)[2]
+            messages = [
+                {"role": "system", "content": [{"type": "text", "text": prompt0}]},
+                {"role": "user",
+                 "content": [{"type": "text", "text": prompt1}, {"type": "image_url", "image_url": {"url":
+                                                                                                        f"data:image/jpeg;base64,{base64_image}",
+                                                                                                    "detail": "high"},
+                                                                 }]},
+            ]
+            if turn_number == 1:
+                messages.append({"role": "assistant", "content": [{"type": "text", "text": f"\n\n{ouput__0}"}]})
+                messages.append({"role": "user", "content": [{"type": "text", "text": prompt2}]})
+        else:
+            # Claude takes the system prompt separately, see request()
+            bits_image = self.read_image(image_path)[0]
+            messages = [
+                {"role": "user",
+                 "content": [{"text": prompt1}, {"image": {"format": "jpeg", "source": {'bytes': bits_image}}}]},
+            ]
+            if turn_number == 1:
+                messages.append({"role": "assistant", "content": [{"text": f"\n\n{ouput__0}"}]})
+                messages.append({"role": "user", "content": [{"text": prompt2}]})
+        return messages
+
+    def get_response_cache_key(self, prompt, image_path, ouput__0, turn_number, model, max_new_tokens, kwargs):
+        """Exact fingerprint of a request: same prompts, same screenshot bytes, same model and settings"""
+        key = hashlib.blake2b(digest_size=16)
+        for part in (model if model else self.model, turn_number, max_new_tokens, sorted(kwargs.items()),
+                     prompt[0], prompt[1], prompt[2], ouput__0):
+            key.update(str(part).encode("utf-8"))
+            key.update(b"\x00")
+        key.update(self.read_image(image_path)[1])
+        return key.hexdigest()
+
+    def generate(self, prompt: list = None, max_new_tokens=4096, temperature=None, model=None, image_path=None,
+                 ouput__0=None, turn_number=0, prompt_cache_key=None, **kwargs):
+        messages = self.build_messages(prompt, image_path=image_path, ouput__0=ouput__0, turn_number=turn_number)
+        if messages is None:
+            return None
+
+        # Only greedy requests are answered from the cache, a sampled answer is meant to differ between calls
+        cache_key = None
+        if self.response_cache_size > 0 and not (temperature if temperature else self.temperature):
+            cache_key = self.get_response_cache_key(prompt, image_path, ouput__0, turn_number, model,
+                                                    max_new_tokens, kwargs)
+            if cache_key in self.response_cache:
+                self.response_cache.move_to_end(cache_key)
+                return self.response_cache[cache_key]
+            if self.response_disk_cache is not None and cache_key in self.response_disk_cache:
+                answer = self.response_disk_cache[cache_key]
+                self.add_to_response_cache(cache_key, answer)
+                return answer
+
+        if self.prompt_cache and prompt_cache_key is not None and self.model != "claude":
+            # Requests sharing a key are routed together, so both turns of a step (and the steps of a task)
+            # hit the cached system prompt, query and screenshot prefix
+            kwargs["prompt_cache_key"] = prompt_cache_key
+        answer = self.request(messages, prompt[0], max_new_tokens=max_new_tokens, temperature=temperature,
+                              model=model, **kwargs)
+
+        if cache_key is not None:
+            self.add_to_response_cache(cache_key, answer)
+            if self.response_disk_cache is not None:
+                self.response_disk_cache[cache_key] = answer
+                self.response_disk_cache.sync()
+        return answer
+
+    def add_to_response_cache(self, cache_key, answer):
+        self.response_cache[cache_key] = answer
+        if len(self.response_cache) > self.response_cache_size:
+            self.response_cache.popitem(last=False)
+
     @backoff.on_exception(
         backoff.expo,
         (APIError, RateLimitError, APIConnectionError, ServiceUnavailableError, InvalidRequestError),
     )
-    def generate(self, prompt: list = None, max_new_tokens=4096, temperature=None, model=None, image_path=None,
-                 ouput__0=None, turn_number=0, **kwargs):
+    def request(self, messages, system_prompt, max_new_tokens=4096, temperature=None, model=None, **kwargs):
         self.current_key_idx = (self.current_key_idx + 1) % len(self.api_keys)
         start_time = time.time()
         if (
@@ -106,81 +226,26 @@ class OpenaiEngine(Engine):
         ):
             time.sleep(self.next_avil_time[self.current_key_idx] - start_time)
         openai.api_key = self.api_keys[self.current_key_idx]
-        prompt0 = prompt[0]
-        prompt1 = prompt[1]
-        prompt2 = prompt[2]
 
-        if turn_number == 0:
-            # Assume one turn dialogue
-            if self.model != "claude":
-                base64_image = encode_image(image_path)
-                prompt1_input = [
-                    {"role": "system", "content": [{"type": "text", "text": prompt0}]},
-                    {"role": "user",
-                     "content": [{"type": "text", "text": prompt1}, {"type": "image_url", "image_url": {"url":
-                                                                                                            f"data:image/jpeg;base64,{base64_image}",
-                                                                                                        "detail": "high"},
-                                                                     }]},
-                ]
-                response1 = openai.ChatCompletion.create(
-                    model=model if model else self.model,
-                    messages=prompt1_input,
-                    max_tokens=max_new_tokens if max_new_tokens else 4096,
-                    temperature=temperature if temperature else self.temperature,
-                    **kwargs,
-                )
-                answer1 = [choice["message"]["content"] for choice in response1["choices"]][0]
-            else:
-                bits_image = claude_encode_image(image_path)
-                prompt1_input = [
-                    {"role": "user",
-                     "content": [{"text": prompt1}, { "image": {"format": "jpeg", "source": {'bytes': bits_image}}}]},
-                ]
-                response1 = client.converse(
-                    modelId=model_id,
-                    messages=prompt1_input,
-                    system=[{'text': prompt0}],
-                    inferenceConfig={"temperature": self.temperature, "topP": 1.0, "maxTokens": max_new_tokens if max_new_tokens else 4096},
-                )
-                answer1 = response1["output"]["message"]["content"][0]["text"] if len(response1["output"]["message"]["content"]) > 0 else ""
-
-            return answer1
-        elif turn_number == 1:
-            if self.model != "claude":
-                base64_image = encode_image(image_path)
-                prompt2_input = [
-                    {"role": "system", "content": [{"type": "text", "text": prompt0}]},
-                    {"role": "user",
-                     "content": [{"type": "text", "text": prompt1}, {"type": "image_url", "image_url": {"url":
-                                                                                                            f"data:image/jpeg;base64,{base64_image}",
-                                                                                                        "detail": "high"}, }]},
-                    {"role": "assistant", "content": [{"type": "text", "text": f"\n\n{ouput__0}"}]},
-                    {"role": "user", "content": [{"type": "text", "text": prompt2}]}, ]
-                response2 = openai.ChatCompletion.create(
-                    model=model if model else self.model,
-                    messages=prompt2_input,
-                    max_tokens=max_new_tokens if max_new_tokens else 4096,
-                    temperature=temperature if temperature else self.temperature,
-                    **kwargs,
-                )
-                answer2 = [choice["message"]["content"] for choice in response2["choices"]][0]
-            else:
-                bits_image = claude_encode_image(image_path)
-                prompt2_input = [
-                    {"role": "user",
-                     "content": [{"text": prompt1}, {"image": {"format": "jpeg", "source": {'bytes': bits_image}}}]},
-                    {"role": "assistant", "content": [{"text": f"\n\n{ouput__0}"}]},
-                    {"role": "user", "content": [{"text": prompt2}]},
-                ]
-                response2 = client.converse(
-                    modelId=model_id,
-                    messages=prompt2_input,
-                    system=[{'text': prompt0}],
-                    inferenceConfig={"temperature": self.temperature, "topP": 1.0, "maxTokens": max_new_tokens if max_new_tokens else 4096},
-                )
-                answer2 = response2["output"]["message"]["content"][0]["text"] if len(response2["output"]["message"]["content"]) > 0 else ""
-
-            return answer2
+        if self.model != "claude":
+            response = openai.ChatCompletion.create(
+                model=model if model else self.model,
+                messages=messages,
+                max_tokens=max_new_tokens if max_new_tokens else 4096,
+                temperature=temperature if temperature else self.temperature,
+                **kwargs,
+            )
+            answer = [choice["message"]["content"] for choice in response["choices"]][0]
+        else:
+            response = client.converse(
+                modelId=model_id,
+                messages=messages,
+                system=[{'text': system_prompt}],
+                inferenceConfig={"temperature": self.temperature, "topP": 1.0, "maxTokens": max_new_tokens if max_new_tokens else 4096},
+            )
+            answer = response["output"]["message"]["content"][0]["text"] if len(response["output"]["message"]["content"]) > 0 else ""
+
+        return answer
 
 
 class OpenaiEngine_MindAct(Engine):
@@ -227,3 +227,31 @@ class CrossEncoder(CrossEncoder):
                 self._eval_during_training(
                     evaluator, output_path, save_best_model, epoch, -1, callback
                 )
+
+    def predict(self, sentences, batch_size: int = 32, **kwargs):
+        """
+        Score sentence pairs like CrossEncoder.predict, but batch them in order of decreasing length
+        Each batch is padded to its longest pair, so grouping pairs of similar length avoids scoring
+        short candidates at the length of the longest element on the page. Scores are returned in the
+        original order.
+
+        :param sentences: A list of sentence pairs [[Sent1, Sent2], [Sent3, Sent4]], or a single pair
+        :param batch_size: Batch size for encoding
+        """
+        if len(sentences) == 0 or isinstance(sentences[0], str):
+            return super().predict(sentences, batch_size=batch_size, **kwargs)
+
+        order = np.argsort(
+            [-sum(len(text) for text in pair) for pair in sentences], kind="stable"
+        )
+        scores = super().predict(
+            [sentences[i] for i in order], batch_size=batch_size, **kwargs
+        )
+
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        if isinstance(scores, np.ndarray):
+            return scores[inverse]
+        if isinstance(scores, torch.Tensor):
+            return scores[torch.from_numpy(inverse).to(scores.device)]
+        return [scores[i] for i in inverse]
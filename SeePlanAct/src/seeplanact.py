@@ -21,16 +21,22 @@ The script is designed to automate complex web interactions, enhancing accessibi
 import argparse
 import asyncio
 import datetime
+import hashlib
+import io
 import json
 import logging
 import os
-import time
+import queue
+import shelve
 import warnings
 from dataclasses import dataclass
-from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
 import toml
 import torch
 from aioconsole import ainput, aprint
+from PIL import Image
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from playwright.async_api import async_playwright
 
 from data_utils.format_prompt_utils import get_index_from_option_name
@@ -39,6 +45,8 @@ from demo_utils.browser_helper import (
     normal_launch_async,
     normal_new_context_async,
     get_interactive_elements_with_playwright,
+    get_page_state_digest,
+    page_total_height_js,
     select_option,
     saveconfig,
 )
@@ -64,6 +72,10 @@ class SessionControl:
     active_cdp_session = None
     context = None
     browser = None
+    # last result of get_interactive_elements_cached, see there
+    interactive_elements = None
+    interactive_elements_page = None
+    interactive_elements_digest = None
 
 
 session_control = SessionControl()
@@ -97,6 +109,7 @@ async def page_on_close_handler(page):
 
 async def page_on_navigatio_handler(frame):
     session_control.active_page = frame.page
+    session_control.interactive_elements = None
 
 async def page_on_crash_handler(page):
     await aprint("Page crashed:", page.url)
@@ -111,6 +124,248 @@ async def page_on_open_handler(page):
     session_control.active_page = page
 
 
+async def get_interactive_elements_cached(page):
+    """
+    Return get_interactive_elements_with_playwright(page), reusing the last result while the page state is unchanged
+    The digest only covers the markup, form values, scroll position, viewport and URL, not computed styles, so
+    the main loop drops the cached list after every executed action (a HOVER can open a CSS menu), and the
+    search-settings setup, where every lookup follows a click that opens a menu, does not use it. What is left to
+    reuse is the next step's walk after a step where nothing was executed (no target element, or a rejected
+    operation in monitor mode).
+    """
+    digest = await get_page_state_digest(page)
+    if (
+        digest is not None
+        and session_control.interactive_elements is not None
+        and session_control.interactive_elements_page is page
+        and session_control.interactive_elements_digest == digest
+    ):
+        return session_control.interactive_elements
+
+    elements = await get_interactive_elements_with_playwright(page)
+    session_control.interactive_elements = elements
+    session_control.interactive_elements_page = page
+    session_control.interactive_elements_digest = digest
+    return elements
+
+
+def find_element(elements, text, tag=None):
+    """
+    Return the locator of the first element whose lowercased description contains text (and whose tag contains tag)
+    Stops at the first match instead of collecting every match, raises IndexError when there is none
+    """
+    for element in elements:
+        if text in element[1].lower() and (tag is None or tag in element[2]):
+            return element[-2]
+    raise IndexError(f"No element matching {text}")
+
+
+# Predicted actions that need no element, as the (target element text, target action) they run as.
+# A TYPE falls back to a GOTO when it names no valid choice.
+page_actions = {
+    "GOTO": ("New URL", "GOTO"),
+    "TYPE": ("New URL", "GOTO"),
+    "SCROLL": ("SCROLL", "SCROLL"),
+    "SEARCH": ("SEARCH", "SEARCH"),
+    "GOBACK": ("GOBACK", "GOBACK"),
+}
+# Predicted actions performed on one of the choices
+element_actions = frozenset(
+    ["CLICK", "SELECT", "TYPE", "PRESS ENTER", "HOVER", "TERMINATE"]
+)
+
+
+async def click_element(selector, target_element, target_value, logger):
+    # form controls get a JS click, it does not wait for them to look clickable
+    logger.info("Try performing a CLICK")
+    if target_element[-1] in ["select", "input"]:
+        await selector.evaluate("element => element.click()", timeout=10000)
+        return
+    try:
+        # a visible element passes the actionability checks right away, one that is still
+        # covered (e.g. by an overlay) after 2s gets the JS click instead of waiting out 10s
+        await selector.click(timeout=2000)
+    except PlaywrightTimeoutError:
+        await selector.evaluate("element => element.click()", timeout=10000)
+
+
+async def native_click(selector, target_element, target_value, logger):
+    logger.info("Try performing a CLICK")
+    await selector.click(timeout=10000)
+
+
+async def hover_element(selector, target_element, target_value, logger):
+    logger.info("Try performing a HOVER")
+    await selector.hover(timeout=10000)
+
+
+async def type_value(selector, target_element, target_value, logger):
+    logger.info('Try performing a "press_sequentially"')
+    try:
+        await selector.clear(timeout=10000)
+        await selector.fill("", timeout=10000)
+        await selector.press_sequentially(target_value, timeout=10000)
+    except Exception as e:
+        await selector.fill(target_value, timeout=10000)
+
+
+async def select_value(selector, target_element, target_value, logger):
+    logger.info("Try performing a SELECT")
+    return await select_option(selector, target_value)
+
+
+async def type_into_input(selector, target_element, target_value, logger):
+    if target_element[-1] not in ["input"]:
+        raise Exception(f"Cannot TYPE into a {target_element[-1]} element")
+    await type_value(selector, target_element, target_value, logger)
+
+
+async def select_in_select(selector, target_element, target_value, logger):
+    if target_element[-1] not in ["select"]:
+        raise Exception(f"Cannot SELECT in a {target_element[-1]} element")
+    return await select_value(selector, target_element, target_value, logger)
+
+
+# Element actions as fallback chains of (operation, what the action history says was done instead).
+# The first operation is the action itself, each next one only runs when the previous one raised.
+action_chains = {
+    "CLICK": [(click_element, None), (hover_element, "a HOVER")],
+    "TYPE": [
+        (type_value, None),
+        (select_in_select, "a SELECT {}"),
+        (click_element, "a CLICK"),
+        (hover_element, "a HOVER"),
+    ],
+    "SELECT": [
+        (select_value, None),
+        (type_into_input, "a TYPE"),
+        (click_element, "a CLICK"),
+        (hover_element, "a HOVER"),
+    ],
+    "HOVER": [
+        (hover_element, None),
+        (native_click, "a CLICK"),
+        (click_element, "a CLICK"),
+    ],
+}
+
+
+def action_prefix(target_element):
+    # "[tag] description -> ", how an element action starts in the action history
+    return f"[{target_element[2]}] {target_element[1]} -> "
+
+
+async def perform_action(
+    selector, target_element, target_action, target_value, new_action, logger
+):
+    """
+    Run the fallback chain of an element action until one of its operations succeeds
+    Returns the action history entry and whether every operation failed
+    """
+    error = None
+    for operation, done_instead in action_chains[target_action]:
+        try:
+            result = await operation(selector, target_element, target_value, logger)
+        except Exception as e:
+            if error is None:
+                error = e
+            continue
+        if done_instead is None:
+            if result is not None:
+                # SELECT reports the option that was picked
+                new_action = new_action.replace(f"{target_value}", f"{result}")
+            return new_action, False
+        break
+    else:
+        result, done_instead = None, None
+
+    failure = f"Failed to {target_action}"
+    if target_action in ["SELECT", "TYPE"]:
+        failure += f' "{target_value}"'
+    failure += f" because {error}"
+    if done_instead is not None:
+        failure += f", did {done_instead.format(result)} instead"
+    new_action = action_prefix(target_element) + failure
+    return new_action, done_instead is None
+
+
+async def prepare_target(selector, highlight, linger=False):
+    try:
+        await selector.scroll_into_view_if_needed(timeout=3000)
+        if highlight:
+            await selector.highlight()
+            # keep the highlight up for a while only when someone is watching
+            if linger:
+                await asyncio.sleep(2.5)
+    except Exception as e:
+        pass
+
+
+async def cancel_task(task):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def extract_section(text, start, ends=()):
+    """
+    Return the stripped part of text after the last start and before the first of ends
+    Same result as text.split(start)[-1].split(end)[0]..., without building the split lists
+    """
+    section = text.rpartition(start)[2]
+    for end in ends:
+        section = section.partition(end)[0]
+    return section.strip()
+
+
+# str.translate tables dropping the brackets (and line breaks) from the plans and history
+remove_brackets = str.maketrans("", "", "()")
+remove_brackets_and_newlines = str.maketrans("", "", "()\n")
+
+
+def high_detail_size(width, height):
+    """
+    Size an image is scaled down to by the OpenAI vision models in "high" detail:
+    fit within 2048x2048, then shrink the shortest side to 768
+    """
+    scale = min(1, 2048 / max(width, height))
+    scale *= min(1, 768 / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def log_openai_call(calls_file, logged_inputs, input_parts, output, task_id):
+    """
+    Append one LLM call to openai_calls.jsonl, its input being the concatenation of input_parts
+    The input is written in full the first time it is seen in the task, repeats only carry its input_hash
+    """
+    # hash the parts one by one, the joined input is only built when it gets written
+    input_hash = hashlib.blake2b(digest_size=16)
+    for part in input_parts:
+        input_hash.update(part.encode("utf-8"))
+    input_hash = input_hash.hexdigest()
+    record = {"input_hash": input_hash}
+    if input_hash not in logged_inputs:
+        logged_inputs.add(input_hash)
+        record["input"] = "".join(input_parts)
+    record.update({"image": 1, "output": output, "task_id": task_id})
+    calls_file.write(json.dumps(record) + "\n")
+    calls_file.flush()
+
+
+async def wait_for_page_settle(page, min_wait=2, timeout=2000):
+    # Wait min_wait secs, so the request the last click starts has begun, then until the page has no network
+    # activity left, for at most timeout ms more
+    await asyncio.sleep(min_wait)
+    try:
+        await page.wait_for_load_state("networkidle", timeout=timeout)
+    except Exception as e:
+        pass
+
+
 async def main(config, base_dir) -> None:
     # basic settings
     is_demo = config["basic"]["is_demo"]
@@ -121,6 +376,23 @@ async def main(config, base_dir) -> None:
             ranker_path = None
     except:
         pass
+    # Inference backend of the ranker: "torch", or "onnx"/"openvino" (needs sentence-transformers>=3.2 and optimum)
+    ranker_backend = "torch"
+    try:
+        ranker_backend = config["basic"]["ranker_backend"]
+    except:
+        pass
+    ranker_model_file = None
+    try:
+        ranker_model_file = config["basic"]["ranker_model_file"]
+    except:
+        pass
+    # Opt-in: run the PyTorch ranker in FP16 when it is on a GPU, this can change the top-k
+    ranker_half = False
+    try:
+        ranker_half = config["basic"]["ranker_half"]
+    except:
+        pass
 
     save_file_dir = (
         os.path.join(base_dir, config["basic"]["save_file_dir"])
@@ -146,6 +418,16 @@ async def main(config, base_dir) -> None:
     highlight = config["experiment"]["highlight"]
     monitor = config["experiment"]["monitor"]
     dev_mode = config["experiment"]["dev_mode"]
+    # Reuse the original plan of a (task, website) pair that was already planned in an earlier run
+    use_plan_cache = False
+    try:
+        use_plan_cache = config["experiment"]["plan_cache"]
+    except:
+        pass
+    plan_cache = None
+    if use_plan_cache:
+        os.makedirs(save_file_dir, exist_ok=True)
+        plan_cache = shelve.open(os.path.join(save_file_dir, "plan_cache"))
 
     try:
         storage_state = config["basic"]["storage_state"]
@@ -185,16 +467,37 @@ async def main(config, base_dir) -> None:
     # Load ranking model for prune candidate elements
     ranking_model = None
     if ranker_path:
+        ranker_kwargs = {}
+        if ranker_backend != "torch":
+            ranker_kwargs["backend"] = ranker_backend
+            if ranker_model_file:
+                # e.g. "onnx/model_O4.onnx" or "onnx/model_qint8_avx512_vnni.onnx"
+                ranker_kwargs["model_kwargs"] = {"file_name": ranker_model_file}
         ranking_model = CrossEncoder(
             ranker_path,
             device=torch.device("cuda" if torch.cuda.is_available() else "cpu"),
             num_labels=1,
             max_length=512,
+            **ranker_kwargs,
         )
+        if ranker_half and ranker_backend == "torch" and torch.cuda.is_available():
+            ranking_model.model.half()
 
     if not is_demo:
         with open(f"{task_file_path}", "r", encoding="utf-8") as file:
             query_tasks = json.load(file)
+        # Every num_shards-th task starting at shard_id, so several processes can split one task file
+        if "shard_id" in config["experiment"] and "num_shards" not in config["experiment"]:
+            raise ValueError("shard_id is set but num_shards is not")
+        num_shards = config["experiment"].get("num_shards", 1)
+        shard_id = config["experiment"].get("shard_id", 0)
+        if num_shards < 1:
+            raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+        if not 0 <= shard_id < num_shards:
+            raise ValueError(
+                f"shard_id must be between 0 and num_shards - 1 ({num_shards - 1}), got {shard_id}"
+            )
+        query_tasks = query_tasks[shard_id::num_shards]
     else:
         query_tasks = []
         task_dict = {}
@@ -209,1169 +512,877 @@ async def main(config, base_dir) -> None:
         task_dict["task_id"] = file_name
         query_tasks.append(task_dict)
 
-    for single_query_task in query_tasks:
+    # One browser process serves every task, each task still gets its own context
+    async with async_playwright() as playwright:
+        session_control.browser = await normal_launch_async(playwright)
+        for single_query_task in query_tasks:
 
-        openai_call = defaultdict(lambda : list())
-        confirmed_task = single_query_task["confirmed_task"]
-        confirmed_website = "https://www.google.com/preferences?hl=iw&lang=1&prev=https://www.google.com/preferences?hl%3Diw"
-        try:
-            confirmed_website_url = website_dict[confirmed_website]
-        except:
-            confirmed_website_url = confirmed_website
-        task_id = single_query_task["task_id"]
-        main_result_path = os.path.join(save_file_dir, task_id)
-
-        if not os.path.exists(main_result_path):
-            os.makedirs(main_result_path)
-        else:
-            await aprint(f"{main_result_path} already exists")
-            if not overwrite:
-                continue
-        saveconfig(config, os.path.join(main_result_path, "config.toml"))
-
-        # init logger
-        logger = logging.getLogger(f"{task_id}")
-        logger.setLevel(logging.INFO)
-        log_fh = logging.FileHandler(
-            os.path.join(main_result_path, f"{task_id}.log"), encoding="utf-8"
-        )
-        log_fh.setLevel(logging.INFO)
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        log_format = logging.Formatter("%(asctime)s - %(message)s")
-        terminal_format = logging.Formatter("%(message)s")
-        log_fh.setFormatter(log_format)
-        console_handler.setFormatter(terminal_format)
-        logger.addHandler(log_fh)
-        logger.addHandler(console_handler)
-
-        logger.info(f"website: {confirmed_website_url}")
-        logger.info(f"task: {confirmed_task}")
-        logger.info(f"id: {task_id}")
-        async with async_playwright() as playwright:
-            session_control.browser = await normal_launch_async(playwright)
-            session_control.context = await normal_new_context_async(
-                session_control.browser,
-                tracing=tracing,
-                storage_state=storage_state,
-                video_path=main_result_path if save_video else None,
-                viewport=viewport_size,
-                trace_screenshots=trace_screenshots,
-                trace_snapshots=trace_snapshots,
-                trace_sources=trace_sources,
-                geolocation=geolocation,
-                locale=locale,
+            confirmed_task = single_query_task["confirmed_task"]
+            confirmed_website = "https://www.google.com/preferences?hl=iw&lang=1&prev=https://www.google.com/preferences?hl%3Diw"
+            try:
+                confirmed_website_url = website_dict[confirmed_website]
+            except:
+                confirmed_website_url = confirmed_website
+            task_id = single_query_task["task_id"]
+            main_result_path = os.path.join(save_file_dir, task_id)
+
+            if not os.path.exists(main_result_path):
+                os.makedirs(main_result_path)
+            else:
+                await aprint(f"{main_result_path} already exists")
+                if not overwrite:
+                    continue
+            saveconfig(config, os.path.join(main_result_path, "config.toml"))
+            # one json line per LLM call, appended as the task runs
+            openai_calls_file = open(
+                os.path.join(main_result_path, "openai_calls.jsonl"),
+                "w",
+                encoding="utf-8",
             )
-            session_control.context.on("page", page_on_open_handler)
-            await session_control.context.new_page()
+            logged_inputs = set()
+
+            # init logger
+            logger = logging.getLogger(f"{task_id}")
+            logger.setLevel(logging.INFO)
+            log_fh = logging.FileHandler(
+                os.path.join(main_result_path, f"{task_id}.log"), encoding="utf-8"
+            )
+            log_fh.setLevel(logging.INFO)
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+            log_format = logging.Formatter("%(asctime)s - %(message)s")
+            terminal_format = logging.Formatter("%(message)s")
+            log_fh.setFormatter(log_format)
+            console_handler.setFormatter(terminal_format)
+            # the file and console writes happen on the listener thread, not in the event loop
+            log_queue_handler = QueueHandler(queue.Queue(-1))
+            log_listener = QueueListener(
+                log_queue_handler.queue, log_fh, console_handler
+            )
+            log_listener.start()
+            logger.addHandler(log_queue_handler)
+
             try:
-                # setup
-                logger.info("Going to settings page")
-                await session_control.active_page.set_extra_http_headers(
-                    {"Accept-Language": "en-US"}
+                logger.info(f"website: {confirmed_website_url}")
+                logger.info(f"task: {confirmed_task}")
+                logger.info(f"id: {task_id}")
+                if not session_control.browser.is_connected():
+                    session_control.browser = await normal_launch_async(playwright)
+                session_control.context = await normal_new_context_async(
+                    session_control.browser,
+                    tracing=tracing,
+                    storage_state=storage_state,
+                    video_path=main_result_path if save_video else None,
+                    viewport=viewport_size,
+                    trace_screenshots=trace_screenshots,
+                    trace_snapshots=trace_snapshots,
+                    trace_sources=trace_sources,
+                    geolocation=geolocation,
+                    locale=locale,
                 )
-                await session_control.active_page.goto(
-                    confirmed_website_url, wait_until="load"
-                )
-                elements = await get_interactive_elements_with_playwright(
-                    session_control.active_page
-                )
-                target_element = elements[6][-2]
-                await target_element.click(timeout=10000)
-                logger.info("Changing language")
-                elements = await get_interactive_elements_with_playwright(
-                    session_control.active_page
-                )
-                target_element = [
-                    x
-                    for x in elements
-                    if "english" in x[1].lower() and "option" in x[2]
-                ][0][-2]
-                await target_element.click(timeout=10000)
-                target_element = [x for x in elements if "אישור" in x[1].lower()][0][-2]
-                await target_element.click(timeout=10000)
-                logger.info("Changing region")
-                time.sleep(2)
-                logger.info("Getting elements")
+                session_control.context.on("page", page_on_open_handler)
+                await session_control.context.new_page()
                 try:
+                    # setup
+                    logger.info("Going to settings page")
+                    await session_control.active_page.set_extra_http_headers(
+                        {"Accept-Language": "en-US"}
+                    )
+                    await session_control.active_page.goto(
+                        confirmed_website_url, wait_until="load"
+                    )
                     elements = await get_interactive_elements_with_playwright(
                         session_control.active_page
                     )
-                    target_element = [
-                        x for x in elements if "results region" in x[1].lower()
-                    ][0][-2]
-                except:
-                    logger.info("Sleeping for 2 secs")
-                    time.sleep(2)
+                    target_element = elements[6][-2]
+                    await target_element.click(timeout=10000)
+                    logger.info("Changing language")
                     elements = await get_interactive_elements_with_playwright(
                         session_control.active_page
                     )
-                    target_element = [
-                        x for x in elements if "results region" in x[1].lower()
-                    ][0][-2]
-                logger.info("Opening results")
-                await target_element.click(timeout=10000)
-                elements = await get_interactive_elements_with_playwright(
-                    session_control.active_page
-                )
-                target_element = [
-                    x for x in elements if "united states" in x[1].lower()
-                ][0][-2]
-                logger.info("Changing to US")
-                await target_element.click(timeout=10000)
-                target_element = [
-                    x for x in elements if "confirm".lower() in x[1].lower()
-                ][0][-2]
-                logger.info("Confirming")
-                await target_element.click(timeout=10000)
-                time.sleep(2)
-                logger.info("Going back to google.com")
-                await session_control.active_page.goto(
-                    "https://www.google.com", wait_until="load"
-                )
-
-            except Exception as e:
-                logger.info("Failed to fully load the webpage before timeout")
-                logger.info(e)
-                await session_control.active_page.goto(
-                    "https://www.google.com", wait_until="load"
-                )
-            # await asyncio.sleep(2)
-
-            taken_actions = []
-            # history + plan
-            original_plan, history, refined_plan = None, "", None
-            complete_flag = False
-            monitor_signal = ""
-            time_step = 0
-            no_op_count = 0
-            valid_op_count = 0
-
-            while not complete_flag:
-                if dev_mode:
-                    logger.info(f"Page at the start: {session_control.active_page}")
-                await session_control.active_page.bring_to_front()
-                terminal_width = 10
-                logger.info("=" * terminal_width)
-                logger.info(f"Time step: {time_step}")
-                logger.info("-" * 10)
-                elements = await get_interactive_elements_with_playwright(
-                    session_control.active_page
-                )
+                    target_element = find_element(elements, "english", tag="option")
+                    await target_element.click(timeout=10000)
+                    target_element = find_element(elements, "אישור")
+                    await target_element.click(timeout=10000)
+                    logger.info("Changing region")
+                    await wait_for_page_settle(session_control.active_page)
+                    logger.info("Getting elements")
+                    try:
+                        elements = await get_interactive_elements_with_playwright(
+                            session_control.active_page
+                        )
+                        target_element = find_element(elements, "results region")
+                    except:
+                        logger.info("Sleeping for 2 secs")
+                        await asyncio.sleep(2)
+                        elements = await get_interactive_elements_with_playwright(
+                            session_control.active_page
+                        )
+                        target_element = find_element(elements, "results region")
+                    logger.info("Opening results")
+                    await target_element.click(timeout=10000)
+                    elements = await get_interactive_elements_with_playwright(
+                        session_control.active_page
+                    )
+                    target_element = find_element(elements, "united states")
+                    logger.info("Changing to US")
+                    await target_element.click(timeout=10000)
+                    target_element = find_element(elements, "confirm")
+                    logger.info("Confirming")
+                    await target_element.click(timeout=10000)
+                    await wait_for_page_settle(session_control.active_page)
+                    logger.info("Going back to google.com")
+                    await session_control.active_page.goto(
+                        "https://www.google.com", wait_until="load"
+                    )
 
-                if tracing:
-                    await session_control.context.tracing.start_chunk(
-                        title=f"{task_id}-Time Step-{time_step}", name=f"{time_step}"
+                except Exception as e:
+                    logger.info("Failed to fully load the webpage before timeout")
+                    logger.info(e)
+                    await session_control.active_page.goto(
+                        "https://www.google.com", wait_until="load"
                     )
-                logger.info(f"# all elements: {len(elements)}")
-                if dev_mode:
-                    for i in elements:
-                        logger.info(i[1:])
-                time_step += 1
-
-                if len(elements) == 0:
-                    if monitor:
-                        logger.info(
-                            f"----------There is no element in this page. Do you want to terminate or continue after"
-                            f"human intervention? [i/e].\ni(Intervene): Reject this action, and pause for human "
-                            f"intervention.\ne(Exit): Terminate the program and save results."
+                # await asyncio.sleep(2)
+
+                taken_actions = []
+                # history + plan
+                original_plan, history, refined_plan = None, "", None
+                plan_cache_key = json.dumps([confirmed_task, confirmed_website])
+                if plan_cache is not None and plan_cache_key in plan_cache:
+                    original_plan = plan_cache[plan_cache_key]
+                    logger.info(f"Original plan loaded from the plan cache: \n{original_plan}")
+                complete_flag = False
+                monitor_signal = ""
+                time_step = 0
+                no_op_count = 0
+                valid_op_count = 0
+
+                while not complete_flag:
+                    if dev_mode:
+                        logger.info(f"Page at the start: {session_control.active_page}")
+                    await session_control.active_page.bring_to_front()
+                    terminal_width = 10
+                    logger.info("=" * terminal_width)
+                    logger.info(f"Time step: {time_step}")
+                    logger.info("-" * 10)
+                    # independent CDP round trips, so the page height is read while the elements are collected
+                    elements, total_height = await asyncio.gather(
+                        get_interactive_elements_cached(session_control.active_page),
+                        session_control.active_page.evaluate(page_total_height_js),
+                    )
+
+                    if tracing:
+                        await session_control.context.tracing.start_chunk(
+                            title=f"{task_id}-Time Step-{time_step}", name=f"{time_step}"
                         )
-                        monitor_input = await ainput()
-                        logger.info("Monitor Command: " + monitor_input)
-                        if monitor_input in ["i", "intervene", "intervention"]:
+                    logger.info(f"# all elements: {len(elements)}")
+                    if dev_mode:
+                        for i in elements:
+                            logger.info(i[1:])
+                    time_step += 1
+
+                    if len(elements) == 0:
+                        if monitor:
                             logger.info(
-                                "Pause for human intervention. Press Enter to continue. You can also enter your message here, which will be included in the action history as a human message."
+                                f"----------There is no element in this page. Do you want to terminate or continue after"
+                                f"human intervention? [i/e].\ni(Intervene): Reject this action, and pause for human "
+                                f"intervention.\ne(Exit): Terminate the program and save results."
+                            )
+                            monitor_input = await ainput()
+                            logger.info("Monitor Command: " + monitor_input)
+                            if monitor_input in ["i", "intervene", "intervention"]:
+                                logger.info(
+                                    "Pause for human intervention. Press Enter to continue. You can also enter your message here, which will be included in the action history as a human message."
+                                )
+                                human_intervention = await ainput()
+                                if human_intervention:
+                                    human_intervention = f"Human intervention with a message: {human_intervention}"
+                                else:
+                                    human_intervention = f"Human intervention"
+                                taken_actions.append(human_intervention)
+                                continue
+
+                        logger.info("Terminate because there is no element in this page.")
+                        logger.info("Action History:")
+                        for action in taken_actions:
+                            logger.info(action)
+                        logger.info("")
+                        if tracing:
+                            logger.info("Save playwright trace file ")
+                            await session_control.context.tracing.stop_chunk(
+                                path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
                             )
-                            human_intervention = await ainput()
-                            if human_intervention:
-                                human_intervention = f"Human intervention with a message: {human_intervention}"
-                            else:
-                                human_intervention = f"Human intervention"
-                            taken_actions.append(human_intervention)
-                            continue
 
-                    logger.info("Terminate because there is no element in this page.")
-                    logger.info("Action History:")
-                    for action in taken_actions:
-                        logger.info(action)
-                    logger.info("")
-                    if tracing:
-                        logger.info("Save playwright trace file ")
-                        await session_control.context.tracing.stop_chunk(
-                            path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
+                        logger.info(
+                            f"Write results to json file: {os.path.join(main_result_path, 'result.json')}"
+                        )
+                        success_or_not = ""
+                        if valid_op_count == 0:
+                            success_or_not = "0"
+                        final_json = {
+                            "confirmed_task": confirmed_task,
+                            "website": confirmed_website,
+                            "task_id": task_id,
+                            "success_or_not": success_or_not,
+                            "num_step": len(taken_actions),
+                            "action_history": taken_actions,
+                            "exit_by": "No elements",
+                        }
+
+                        with open(
+                            os.path.join(main_result_path, "result.json"),
+                            "w",
+                            encoding="utf-8",
+                        ) as file:
+                            json.dump(final_json, file, indent=4)
+                        # logger.shutdown()
+                        #
+                        # if monitor:
+                        #     logger.info("Wait for human inspection. Directly press Enter to exit")
+                        #     monitor_input = await ainput()
+                        logger.info("Close brownser context")
+
+                        close_context = session_control.context
+                        session_control.context = None
+                        await close_context.close()
+                        complete_flag = True
+                        continue
+                    if ranker_path and len(elements) > top_k:
+                        ranking_input = format_ranking_input(
+                            elements, confirmed_task, taken_actions
+                        )
+                        logger.info("Start to rank")
+                        pred_scores = ranking_model.predict(
+                            ranking_input,
+                            convert_to_numpy=True,
+                            show_progress_bar=False,
+                            batch_size=min(len(ranking_input), 256),
                         )
+                        topk_values, topk_indices = find_topk(
+                            pred_scores, k=min(top_k, len(elements))
+                        )
+                        all_candidate_ids = list(topk_indices)
+                        ranked_elements = [elements[i] for i in all_candidate_ids]
+                    else:
 
-                    logger.info(
-                        f"Write results to json file: {os.path.join(main_result_path, 'result.json')}"
-                    )
-                    success_or_not = ""
-                    if valid_op_count == 0:
-                        success_or_not = "0"
-                    final_json = {
-                        "confirmed_task": confirmed_task,
-                        "website": confirmed_website,
-                        "task_id": task_id,
-                        "success_or_not": success_or_not,
-                        "num_step": len(taken_actions),
-                        "action_history": taken_actions,
-                        "exit_by": "No elements",
-                    }
-
-                    with open(
-                        os.path.join(main_result_path, "result.json"),
-                        "w",
-                        encoding="utf-8",
-                    ) as file:
-                        json.dump(final_json, file, indent=4)
-                    # logger.shutdown()
-                    #
-                    # if monitor:
-                    #     logger.info("Wait for human inspection. Directly press Enter to exit")
-                    #     monitor_input = await ainput()
-                    logger.info("Close brownser context")
-                    logger.removeHandler(log_fh)
-                    logger.removeHandler(console_handler)
-
-                    close_context = session_control.context
-                    session_control.context = None
-                    await close_context.close()
-                    complete_flag = True
-                    continue
-                if ranker_path and len(elements) > top_k:
-                    ranking_input = format_ranking_input(
-                        elements, confirmed_task, taken_actions
-                    )
-                    logger.info("Start to rank")
-                    pred_scores = ranking_model.predict(
-                        ranking_input,
-                        convert_to_numpy=True,
-                        show_progress_bar=False,
-                        batch_size=100,
-                    )
-                    topk_values, topk_indices = find_topk(
-                        pred_scores, k=min(top_k, len(elements))
-                    )
-                    all_candidate_ids = list(topk_indices)
-                    ranked_elements = [elements[i] for i in all_candidate_ids]
-                else:
-
-                    all_candidate_ids = range(len(elements))
-                    ranked_elements = elements
-
-                all_candidate_ids_with_location = []
-                for element_id, element_detail in zip(
-                    all_candidate_ids, ranked_elements
-                ):
-                    all_candidate_ids_with_location.append(
+                        all_candidate_ids = range(len(elements))
+                        ranked_elements = elements
+
+                    # (id, y, x) of every candidate, in reading order
+                    all_candidate_ids_with_location = sorted(
                         (
-                            element_id,
-                            round(element_detail[0][1]),
-                            round(element_detail[0][0]),
-                        )
+                            (
+                                element_id,
+                                round(element_detail[0][1]),
+                                round(element_detail[0][0]),
+                            )
+                            for element_id, element_detail in zip(
+                                all_candidate_ids, ranked_elements
+                            )
+                        ),
+                        key=itemgetter(1, 2),
                     )
 
-                all_candidate_ids_with_location.sort(key=lambda x: (x[1], x[2]))
-
-                all_candidate_ids = [
-                    element_id[0] for element_id in all_candidate_ids_with_location
-                ]
-                num_choices = len(all_candidate_ids)
-                if ranker_path:
-                    logger.info(f"# element candidates: {num_choices}")
-
-                total_height = await session_control.active_page.evaluate(
-                    """() => {
-                                                                return Math.max(
-                                                                    document.documentElement.scrollHeight, 
-                                                                    document.body.scrollHeight,
-                                                                    document.documentElement.clientHeight
-                                                                );
-                                                            }"""
-                )
-                if dynamic_choice_batch_size > 0:
-                    step_length = min(
-                        num_choices,
-                        num_choices
-                        // max(round(total_height / dynamic_choice_batch_size), 1)
-                        + 1,
-                    )
-                else:
-                    step_length = min(num_choices, fixed_choice_batch_size)
-                logger.info(f"batch size: {step_length}")
-                logger.info("-" * 10)
-
-                total_width = session_control.active_page.viewport_size["width"]
-                log_task = (
-                    "You are asked to complete the following task: " + confirmed_task
-                )
-                logger.info(log_task)
-                previous_actions = taken_actions
-                previous_action_text = "Previous Actions:\n"
-                if previous_actions is None or previous_actions == []:
-                    previous_actions = ["None"]
-                for action_text in previous_actions:
-                    previous_action_text += action_text
-                    previous_action_text += "\n"
-
-                log_previous_actions = previous_action_text
-                logger.info(log_previous_actions[:-1])
-
-                target_element = []
-
-                new_action = ""
-                target_action = "CLICK"
-                target_value = ""
-                query_count = 0
-                got_one_answer = False
-
-                for multichoice_i in range(0, 1):
+                    all_candidate_ids = [
+                        element_id[0] for element_id in all_candidate_ids_with_location
+                    ]
+                    num_choices = len(all_candidate_ids)
+                    if ranker_path:
+                        logger.info(f"# element candidates: {num_choices}")
+
+                    if dynamic_choice_batch_size > 0:
+                        step_length = min(
+                            num_choices,
+                            num_choices
+                            // max(round(total_height / dynamic_choice_batch_size), 1)
+                            + 1,
+                        )
+                    else:
+                        step_length = min(num_choices, fixed_choice_batch_size)
+                    logger.info(f"batch size: {step_length}")
                     logger.info("-" * 10)
-                    logger.info(
-                        f"Start Multi-Choice QA - Batch {multichoice_i // step_length}"
-                    )
-                    input_image_path = os.path.join(
-                        main_result_path,
-                        "image_inputs",
-                        f"{time_step}_{multichoice_i // step_length}_crop.jpg",
-                    )
 
-                    height_start = all_candidate_ids_with_location[multichoice_i][1]
-                    height_end = all_candidate_ids_with_location[
-                        min(multichoice_i + step_length, num_choices) - 1
-                    ][1]
-
-                    total_height = await session_control.active_page.evaluate(
-                        """() => {
-                                                                    return Math.max(
-                                                                        document.documentElement.scrollHeight, 
-                                                                        document.body.scrollHeight,
-                                                                        document.documentElement.clientHeight
-                                                                    );
-                                                                }"""
+                    total_width = session_control.active_page.viewport_size["width"]
+                    log_task = (
+                        "You are asked to complete the following task: " + confirmed_task
                     )
-                    clip_start = min(total_height - 1144, max(0, height_start - 200))
-                    clip_height = min(
-                        total_height - clip_start,
-                        max(height_end - height_start + 200, 1144),
+                    logger.info(log_task)
+                    previous_action_text = "Previous Actions:\n" + "\n".join(
+                        taken_actions or ["None"]
                     )
-                    clip = {
-                        "x": 0,
-                        "y": clip_start,
-                        "width": total_width,
-                        "height": clip_height,
-                    }
+                    logger.info(previous_action_text)
 
-                    if dev_mode:
-                        logger.info(height_start)
-                        logger.info(height_end)
-                        logger.info(total_height)
-                        logger.info(clip)
+                    target_element = []
 
-                    try:
-                        await session_control.active_page.screenshot(
-                            path=input_image_path,
-                            clip=clip,
-                            full_page=False,
-                            type="jpeg",
-                            quality=100,
-                            timeout=20000,
-                        )
-                        # elements = await get_interactive_elements_with_playwright(
-                        #     session_control.active_page, clip=clip
-                        # )
-                        # await session_control.active_page.locator("#Personal_life").screenshot(path=input_image_path,
-                        #                                               type='jpeg')
-                    except Exception as e_clip:
+                    new_action = ""
+                    target_action = "CLICK"
+                    target_value = ""
+                    query_count = 0
+                    got_one_answer = False
+
+                    for multichoice_i in range(0, 1):
+                        logger.info("-" * 10)
                         logger.info(
-                            f"Failed to get cropped screenshot because {e_clip}"
+                            f"Start Multi-Choice QA - Batch {multichoice_i // step_length}"
+                        )
+                        input_image_path = os.path.join(
+                            main_result_path,
+                            "image_inputs",
+                            f"{time_step}_{multichoice_i // step_length}_crop.jpg",
                         )
 
-                    if dev_mode:
-                        logger.info(multichoice_i)
-                    if not os.path.exists(input_image_path):
-                        if dev_mode:
-                            logger.info("No screenshot")
-                        continue
+                        height_start = all_candidate_ids_with_location[multichoice_i][1]
+                        height_end = all_candidate_ids_with_location[
+                            min(multichoice_i + step_length, num_choices) - 1
+                        ][1]
 
-                    # take only relevant candidate ids
-                    clip_x_min = clip['x']
-                    clip_x_max = clip['x'] + clip['width']
-                    clip_y_min = clip['y']
-                    clip_y_max = clip['y'] + clip['height']
-
-                    screenshot_candidate_ids = []
-                    for el in all_candidate_ids_with_location:
-                        elem_id, elem_y, elem_x = el
-                        # Check if the element's coordinates are within the clip bounds
-                        if clip_x_min <= elem_x <= clip_x_max and clip_y_min <= elem_y <= clip_y_max:
-                            screenshot_candidate_ids.append(elem_id)
-
-                    # candidate_ids = all_candidate_ids[
-                    #     multichoice_i : multichoice_i + step_length
-                    # ]
-                    candidate_ids = screenshot_candidate_ids
-                    choices = format_choices(
-                        elements, screenshot_candidate_ids, confirmed_task, taken_actions
-                    )
-                    query_count += 1
-                    # Format prompts for LLM inference
-                    prompt = generate_prompt(
-                        task=confirmed_task,
-                        previous=taken_actions,
-                        choices=choices,
-                        original_plan=original_plan,
-                        history=history,
-                        refined_plan=refined_plan,
-                        experiment_split="SeeAct",
-                    )
-                    if dev_mode:
-                        for prompt_i in prompt:
-                            logger.info(prompt_i)
+                        # total_height was read with the elements at the start of the step, nothing scrolls in between
+                        clip_start = min(total_height - 1144, max(0, height_start - 200))
+                        clip_height = min(
+                            total_height - clip_start,
+                            max(height_end - height_start + 200, 1144),
+                        )
+                        clip = {
+                            "x": 0,
+                            "y": clip_start,
+                            "width": total_width,
+                            "height": clip_height,
+                        }
 
-                    output0 = generation_model.generate(
-                        prompt=prompt, image_path=input_image_path, turn_number=0
-                    )
-                    openai_call['input'].append(prompt[0] + prompt[1])
-                    openai_call['image'].append(1)
-                    openai_call['output'].append(output0)
-                    openai_call['task_id'] = task_id
-                    with open(os.path.join(main_result_path, 'openai_calls.json'), 'w') as f:
-                        json.dump(openai_call, f)
+                        if dev_mode:
+                            logger.info(height_start)
+                            logger.info(height_end)
+                            logger.info(total_height)
+                            logger.info(clip)
+
+                        # Tall clips are shrunk to the usual 1144px height before they reach the model. OpenAI
+                        # models get the size they would downscale to themselves, so the bytes are not uploaded for nothing
+                        if generation_model.model != "claude":
+                            image_size = high_detail_size(total_width, clip_height)
+                        else:
+                            image_size = (total_width, min(clip_height, 1144))
+                        try:
+                            if image_size != (total_width, clip_height):
+                                screenshot_bytes = await session_control.active_page.screenshot(
+                                    clip=clip,
+                                    full_page=False,
+                                    type="jpeg",
+                                    quality=100,
+                                    timeout=20000,
+                                )
+                                screenshot_image = Image.open(io.BytesIO(screenshot_bytes))
+                                screenshot_image.thumbnail(image_size)
+                                os.makedirs(os.path.dirname(input_image_path), exist_ok=True)
+                                screenshot_image.save(input_image_path, "JPEG", quality=80)
+                            else:
+                                await session_control.active_page.screenshot(
+                                    path=input_image_path,
+                                    clip=clip,
+                                    full_page=False,
+                                    type="jpeg",
+                                    quality=80,
+                                    timeout=20000,
+                                )
+                            # elements = await get_interactive_elements_with_playwright(
+                            #     session_control.active_page, clip=clip
+                            # )
+                            # await session_control.active_page.locator("#Personal_life").screenshot(path=input_image_path,
+                            #                                               type='jpeg')
+                        except Exception as e_clip:
+                            logger.info(
+                                f"Failed to get cropped screenshot because {e_clip}"
+                            )
 
+                        if dev_mode:
+                            logger.info(multichoice_i)
+                        if not os.path.exists(input_image_path):
+                            if dev_mode:
+                                logger.info("No screenshot")
+                            continue
 
-                    terminal_width = 10
-                    logger.info("-" * terminal_width)
-                    logger.info("🤖Action Generation Output🤖")
-
-                    # logger.info(output0)
-                    # set history
-                    if original_plan != None:
-                        logger.info("Setting refined plan")
-                        split_sep = (
-                            "New refined plan)"
-                            if "New refined plan)" in output0
-                            else "Refined plan)"
+                        # take only relevant candidate ids
+                        clip_x_min = clip['x']
+                        clip_x_max = clip['x'] + clip['width']
+                        clip_y_min = clip['y']
+                        clip_y_max = clip['y'] + clip['height']
+
+                        # Keep the elements whose coordinates are within the clip bounds
+                        screenshot_candidate_ids = [
+                            elem_id
+                            for elem_id, elem_y, elem_x in all_candidate_ids_with_location
+                            if clip_x_min <= elem_x <= clip_x_max
+                            and clip_y_min <= elem_y <= clip_y_max
+                        ]
+
+                        # candidate_ids = all_candidate_ids[
+                        #     multichoice_i : multichoice_i + step_length
+                        # ]
+                        candidate_ids = screenshot_candidate_ids
+                        choices = format_choices(
+                            elements, screenshot_candidate_ids, confirmed_task, taken_actions
                         )
-                        refined_plan = (
-                            output0.split(split_sep)[-1]
-                            .split("Next Action Based ")[0]
-                            .strip()
-                            .replace("(", "")
-                            .replace(")", "")
+                        query_count += 1
+                        # Format prompts for LLM inference
+                        prompt = generate_prompt(
+                            task=confirmed_task,
+                            previous=taken_actions,
+                            choices=choices,
+                            original_plan=original_plan,
+                            history=history,
+                            refined_plan=refined_plan,
+                            experiment_split="SeeAct",
                         )
-                        refined_plan = refined_plan.strip()
-                        logger.info(f"Refined plan set to: \n {refined_plan}")
-
-                    if original_plan is None:
-                        logger.info("Setting original_plan")
-                        original_plan = (
-                            output0.split("Original plan)")[-1]
-                            .split("Current Webpage")[0]
-                            .strip()
-                            .replace("(", "")
-                            .replace(")", "")
+                        if dev_mode:
+                            for prompt_i in prompt:
+                                logger.info(prompt_i)
+
+                        # the blocking API call runs on a worker thread, so the event loop keeps serving the page
+                        output0 = await asyncio.to_thread(
+                            generation_model.generate,
+                            prompt=prompt,
+                            image_path=input_image_path,
+                            turn_number=0,
+                            prompt_cache_key=task_id,
+                        )
+                        log_openai_call(
+                            openai_calls_file,
+                            logged_inputs,
+                            (prompt[0], prompt[1]),
+                            output0,
+                            task_id,
                         )
-                        original_plan = original_plan.strip()
-                        logger.info(f"Original plan set to: \n{original_plan}")
-
-                    history = (
-                        history
-                        + "\n"
-                        + f"Step {time_step}. \n"
-                        + output0.split("Relevant information")[-1]
-                        .split("Next Action Based on Webpage and Analysis")[0]
-                        .split("Refined plan")[0]
-                        .split("New refined plan")[0]
-                        .strip()
-                        .replace("\n", "")
-                        .replace("(", "")
-                        .replace(")", "")
-                    )
-                    history = history.strip()
-                    for line in output0.split("\n"):
-                        logger.info(line)
 
-                    terminal_width = 10
-                    logger.info("-" * (terminal_width))
 
-                    choice_text = (
-                        f"(Multichoice Question) - Batch {multichoice_i // step_length}"
-                        + "\n"
-                        + format_options(choices)
-                    )
-                    choice_text = choice_text.replace("\n\n", "")
+                        terminal_width = 10
+                        logger.info("-" * terminal_width)
+                        logger.info("🤖Action Generation Output🤖")
 
-                    for line in choice_text.split("\n"):
-                        logger.info(line)
-                    # logger.info(choice_text)
+                        # logger.info(output0)
+                        # set history
+                        if original_plan != None:
+                            logger.info("Setting refined plan")
+                            split_sep = (
+                                "New refined plan)"
+                                if "New refined plan)" in output0
+                                else "Refined plan)"
+                            )
+                            refined_plan = (
+                                extract_section(output0, split_sep, ("Next Action Based ",))
+                                .translate(remove_brackets)
+                                .strip()
+                            )
+                            logger.info(f"Refined plan set to: \n {refined_plan}")
+
+                        if original_plan is None:
+                            logger.info("Setting original_plan")
+                            original_plan = (
+                                extract_section(output0, "Original plan)", ("Current Webpage",))
+                                .translate(remove_brackets)
+                                .strip()
+                            )
+                            logger.info(f"Original plan set to: \n{original_plan}")
+                            if plan_cache is not None and original_plan:
+                                plan_cache[plan_cache_key] = original_plan
+                                plan_cache.sync()
+
+                        history = (
+                            history
+                            + "\n"
+                            + f"Step {time_step}. \n"
+                            + extract_section(
+                                output0,
+                                "Relevant information",
+                                (
+                                    "Next Action Based on Webpage and Analysis",
+                                    "Refined plan",
+                                    "New refined plan",
+                                ),
+                            ).translate(remove_brackets_and_newlines)
+                        )
+                        history = history.strip()
+                        logger.info(output0)
 
-                    output = generation_model.generate(
-                        prompt=prompt,
-                        image_path=input_image_path,
-                        turn_number=1,
-                        ouput__0=output0,
-                    )
-                    openai_call['input'].append(prompt[0] + prompt[1] + prompt[2] + output0)
-                    openai_call['image'].append(1)
-                    openai_call['output'].append(output)
-                    with open(os.path.join(main_result_path, 'openai_calls.json'), 'w') as f:
-                        json.dump(openai_call, f)
+                        terminal_width = 10
+                        logger.info("-" * (terminal_width))
 
-                    terminal_width = 10
-                    logger.info("-" * terminal_width)
-                    logger.info("🤖Grounding Output🤖")
-
-                    for line in output.split("\n"):
-                        logger.info(line)
-                    # logger.info(output)
-                    pred_element, pred_action, pred_value = postprocess_action_lmm(
-                        output
-                    )
-                    if len(pred_element) in [1, 2]:
-                        element_id = get_index_from_option_name(pred_element)
-                    else:
-                        element_id = -1
-
-                    # goto
-                    if pred_action.strip() in [
-                        "GOTO",
-                        "SEARCH",
-                        "TYPE",
-                        "GOBACK"
-                    ]:
-                        target_element = "New URL"
-                        target_element_text = "New URL"
-                        target_action = "GOTO"
-                        target_value = pred_value
-                        got_one_answer = True
-
-                    # scroll
-                    if pred_action.strip() in ["SCROLL"]:
-                        target_element = "SCROLL"
-                        target_element_text = "SCROLL"
-                        target_action = "SCROLL"
-                        target_value = pred_value
-                        got_one_answer = True
-
-                    if pred_action.strip() in ["SEARCH"]:
-                        target_element = "SEARCH"
-                        target_element_text = "SEARCH"
-                        target_action = "SEARCH"
-                        target_value = pred_value
-                        got_one_answer = True
-
-                    if pred_action.strip() in ["GOBACK"]:
-                        target_element = "GOBACK"
-                        target_element_text = "GOBACK"
-                        target_action = "GOBACK"
-                        target_value = pred_value
-                        got_one_answer = True
-
-                    # Process the elements
-                    if 0 <= element_id < len(candidate_ids) and pred_action.strip() in [
-                        "CLICK",
-                        "SELECT",
-                        "TYPE",
-                        "PRESS ENTER",
-                        "HOVER",
-                        "TERMINATE",
-                    ]:
-                        target_element = elements[int(choices[element_id][0])]
-                        target_element_text = choices[element_id][1]
-                        target_action = pred_action
-                        target_value = pred_value
-                        new_action += "[" + target_element[2] + "]" + " "
-                        new_action += target_element[1] + " -> " + target_action
-                        if target_action.strip() in ["SELECT", "TYPE"]:
-                            new_action += ": " + target_value
-                        got_one_answer = True
-                        break
-                    elif pred_action.strip() in ["PRESS ENTER", "TERMINATE"]:
-                        target_element = pred_action
-                        target_element_text = target_element
-                        target_action = pred_action
-                        target_value = pred_value
-                        new_action += target_action
-                        if target_action.strip() in ["SELECT", "TYPE"]:
-                            new_action += ": " + target_value
-                        got_one_answer = True
-                        break
-                    else:
-                        pass
+                        choice_text = (
+                            f"(Multichoice Question) - Batch {multichoice_i // step_length}"
+                            + "\n"
+                            + format_options(choices)
+                        )
+                        choice_text = choice_text.replace("\n\n", "")
 
-                if got_one_answer:
-                    terminal_width = 10
-                    logger.info("-" * terminal_width)
-                    logger.info("🤖Browser Operation🤖")
-                    logger.info(
-                        f"Target Element: {target_element_text}",
-                    )
-                    logger.info(
-                        f"Target Action: {target_action}",
-                    )
-                    logger.info(
-                        f"Target Value: {target_value}",
-                    )
+                        logger.info(choice_text)
 
-                    if monitor:
-                        logger.info(
-                            f"----------\nShould I execute the above action? [Y/n/i/e].\nY/n: Accept or reject this action.\ni(Intervene): Reject this action, and pause for human intervention.\ne(Exit): Terminate the program and save results."
+                        output = await asyncio.to_thread(
+                            generation_model.generate,
+                            prompt=prompt,
+                            image_path=input_image_path,
+                            turn_number=1,
+                            ouput__0=output0,
+                            prompt_cache_key=task_id,
+                        )
+                        log_openai_call(
+                            openai_calls_file,
+                            logged_inputs,
+                            (prompt[0], prompt[1], prompt[2], output0),
+                            output,
+                            task_id,
                         )
-                        monitor_input = await ainput()
-                        logger.info("Monitor Command: " + monitor_input)
-                        if monitor_input in ["n", "N", "No", "no"]:
-                            monitor_signal = "reject"
-                            target_element = []
-                        elif monitor_input in ["e", "exit", "Exit"]:
-                            monitor_signal = "exit"
-                        elif monitor_input in ["i", "intervene", "intervention"]:
-                            monitor_signal = "pause"
-                            target_element = []
-                        else:
-                            valid_op_count += 1
-                else:
-                    no_op_count += 1
-                    target_element = []
 
-                try:
-                    if monitor_signal == "exit":
-                        raise Exception("human supervisor manually made it exit.")
-                    if no_op_count >= max_continuous_no_op:
-                        raise Exception(
-                            f"no executable operations for {max_continuous_no_op} times."
+                        terminal_width = 10
+                        logger.info("-" * terminal_width)
+                        logger.info("🤖Grounding Output🤖")
+
+                        logger.info(output)
+                        # postprocess_action_lmm already strips the action
+                        pred_element, pred_action, pred_value = postprocess_action_lmm(
+                            output
                         )
-                    elif time_step >= max_op:
-                        raise Exception(f"the agent reached the step limit {max_op}.")
-                    elif target_action == "TERMINATE":
-                        raise Exception("The model determined a completion.")
-
-                    # Perform browser action with PlayWright
-                    # The code is complex to handle all kinds of cases in execution
-                    # It's ugly, but it works, so far
-                    selector = None
-                    fail_to_execute = False
-                    try:
-                        if target_element == []:
-                            pass
+                        if len(pred_element) in [1, 2]:
+                            element_id = get_index_from_option_name(pred_element)
                         else:
-                            if not target_element in ["PRESS ENTER", "TERMINATE"]:
-                                selector = target_element[-2]
-                                if dev_mode:
-                                    logger.info(target_element)
-                                try:
-                                    await selector.scroll_into_view_if_needed(
-                                        timeout=3000
-                                    )
-                                    if highlight:
-                                        await selector.highlight()
-                                        await asyncio.sleep(2.5)
-                                except Exception as e:
-                                    pass
-
-                        if selector:
-                            valid_op_count += 1
-                            if target_action == "CLICK":
-                                js_click = True
-                                try:
-                                    if target_element[-1] in ["select", "input"]:
-                                        logger.info("Try performing a CLICK")
-                                        await selector.evaluate(
-                                            "element => element.click()", timeout=10000
-                                        )
-                                        js_click = False
-                                    else:
-                                        await selector.click(timeout=10000)
-                                except Exception as e:
-                                    try:
-                                        if not js_click:
-                                            logger.info("Try performing a CLICK")
-                                            await selector.evaluate(
-                                                "element => element.click()",
-                                                timeout=10000,
-                                            )
-                                        else:
-                                            raise Exception(e)
-                                    except Exception as ee:
-                                        try:
-                                            logger.info("Try performing a HOVER")
-                                            await selector.hover(timeout=10000)
-                                            new_action = new_action.replace(
-                                                "CLICK",
-                                                f"Failed to CLICK because {e}, did a HOVER instead",
-                                            )
-                                        except Exception as eee:
-                                            new_action = new_action.replace(
-                                                "CLICK", f"Failed to CLICK because {e}"
-                                            )
-                                            no_op_count += 1
-
-                            elif target_action == "GOTO":
-                                logger.info(f"Trying to go to {target_value}")
-                                if not target_value.startswith("https://www."):
-                                    if target_value.startswith("www."):
-                                        target_value = "https://" + target_value
-                                    else:
-                                        target_value = "https://www." + target_value
-                                logger.info(f"Now trying to go to {target_value}")
-                                await session_control.active_page.goto(
-                                    target_value, wait_until="load"
-                                )
-
-                            elif target_action == "SEARCH":
-                                await session_control.active_page.goto(
-                                    "https://www.google.com/", wait_until="load"
-                                )
-                                elements = await get_interactive_elements_with_playwright(
-                                    session_control.active_page
-                                )
-                                search_element = [x for x in elements if "Search" in x[1] and "title" in x[1]][0][-2]
-                                await search_element.press_sequentially(
-                                    target_value, timeout=10000
-                                )
-                                click_element = [x for x in elements if "Google Search" in x[1]][0][-2]
-                                await click_element.evaluate(
-                                    "element => element.click()", timeout=10000
-                                )
+                            element_id = -1
+
+                        # goto, scroll, search and go back
+                        if pred_action in page_actions:
+                            target_element, target_action = page_actions[pred_action]
+                            target_element_text = target_element
+                            target_value = pred_value
+                            got_one_answer = True
+
+                        # Process the elements
+                        if 0 <= element_id < len(candidate_ids) and pred_action in element_actions:
+                            # choices[element_id] was built from elements[candidate_ids[element_id]]
+                            target_element = elements[candidate_ids[element_id]]
+                            target_element_text = choices[element_id][1]
+                            target_action = pred_action
+                            target_value = pred_value
+                            new_action += action_prefix(target_element) + target_action
+                            if target_action in ["SELECT", "TYPE"]:
+                                new_action += ": " + target_value
+                            got_one_answer = True
+                            break
+                        elif pred_action in ["PRESS ENTER", "TERMINATE"]:
+                            target_element = pred_action
+                            target_element_text = target_element
+                            target_action = pred_action
+                            target_value = pred_value
+                            new_action += target_action
+                            if target_action in ["SELECT", "TYPE"]:
+                                new_action += ": " + target_value
+                            got_one_answer = True
+                            break
+                        else:
+                            pass
 
-                            # scroll
-                            elif target_action == "SCROLL":
-                                logger.info(f"Scrolling {target_value}")
-                                if target_value.lower() == "up":
-                                    await session_control.active_page.evaluate(
-                                        f"window.scrollTo(0, 0);"
-                                    )  # Scroll down 1000 pixels
-                                else:
-                                    window_height = await session_control.active_page.evaluate(
-                                     'window.innerHeight'
-                                    )
-                                    await session_control.active_page.evaluate(
-                                        f"window.scrollBy(0, {int(window_height*0.75)});"
-                                    )  # Scroll down 1000 pixels
+                    # Without a monitor the target is scrolled into view (and highlighted) while the operation is
+                    # logged. With one, nothing touches the page before the supervisor accepts the operation.
+                    prepare_task = None
+                    can_prepare = (
+                        got_one_answer
+                        and not isinstance(target_element, str)
+                        and target_action != "TERMINATE"
+                    )
+                    if can_prepare and not monitor:
+                        prepare_task = asyncio.create_task(
+                            prepare_target(target_element[-2], highlight, linger=dev_mode)
+                        )
 
-                            elif target_action == "GOBACK":
-                                logger.info(f"Going back")
-                                await session_control.active_page.go_back();
+                    if got_one_answer:
+                        terminal_width = 10
+                        logger.info("-" * terminal_width)
+                        logger.info("🤖Browser Operation🤖")
+                        logger.info(
+                            f"Target Element: {target_element_text}",
+                        )
+                        logger.info(
+                            f"Target Action: {target_action}",
+                        )
+                        logger.info(
+                            f"Target Value: {target_value}",
+                        )
 
-                            elif target_action == "TYPE":
-                                try:
-                                    try:
-                                        logger.info(
-                                            'Try performing a "press_sequentially"'
-                                        )
-                                        await selector.clear(timeout=10000)
-                                        await selector.fill("", timeout=10000)
-                                        await selector.press_sequentially(
-                                            target_value, timeout=10000
+                        if monitor:
+                            logger.info(
+                                f"----------\nShould I execute the above action? [Y/n/i/e].\nY/n: Accept or reject this action.\ni(Intervene): Reject this action, and pause for human intervention.\ne(Exit): Terminate the program and save results."
+                            )
+                            monitor_input = await ainput()
+                            logger.info("Monitor Command: " + monitor_input)
+                            if monitor_input in ["n", "N", "No", "no"]:
+                                monitor_signal = "reject"
+                                target_element = []
+                            elif monitor_input in ["e", "exit", "Exit"]:
+                                monitor_signal = "exit"
+                            elif monitor_input in ["i", "intervene", "intervention"]:
+                                monitor_signal = "pause"
+                                target_element = []
+                            else:
+                                valid_op_count += 1
+                                if can_prepare:
+                                    prepare_task = asyncio.create_task(
+                                        prepare_target(
+                                            target_element[-2], highlight, linger=True
                                         )
-                                    except Exception as e0:
-                                        await selector.fill(target_value, timeout=10000)
-                                except Exception as e:
-                                    try:
-                                        if target_element[-1] in ["select"]:
-                                            logger.info("Try performing a SELECT")
-                                            selected_value = await select_option(
-                                                selector, target_value
-                                            )
-                                            new_action = new_action.replace(
-                                                "TYPE",
-                                                f'Failed to TYPE "{target_value}" because {e}, did a SELECT {selected_value} instead',
-                                            )
-                                        else:
-                                            raise Exception(e)
-                                    except Exception as ee:
-                                        js_click = True
-                                        try:
-                                            if target_element[-1] in [
-                                                "select",
-                                                "input",
-                                            ]:
-                                                logger.info("Try performing a CLICK")
-                                                await selector.evaluate(
-                                                    "element => element.click()",
-                                                    timeout=10000,
-                                                )
-                                                js_click = False
-                                            else:
-                                                logger.info("Try performing a CLICK")
-                                                await selector.click(timeout=10000)
-                                            new_action = (
-                                                "[" + target_element[2] + "]" + " "
-                                            )
-                                            new_action += (
-                                                target_element[1]
-                                                + " -> "
-                                                + f'Failed to TYPE "{target_value}" because {e}, did a CLICK instead'
-                                            )
-                                        except Exception as eee:
-                                            try:
-                                                if not js_click:
-                                                    if dev_mode:
-                                                        logger.info(eee)
-                                                    logger.info(
-                                                        "Try performing a CLICK"
-                                                    )
-                                                    await selector.evaluate(
-                                                        "element => element.click()",
-                                                        timeout=10000,
-                                                    )
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to TYPE "{target_value}" because {e}, did a CLICK instead'
-                                                    )
-                                                else:
-                                                    raise Exception(eee)
-                                            except Exception as eeee:
-                                                try:
-                                                    logger.info(
-                                                        "Try performing a HOVER"
-                                                    )
-                                                    await selector.hover(timeout=10000)
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to TYPE "{target_value}" because {e}, did a HOVER instead'
-                                                    )
-                                                except Exception as eee:
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to TYPE "{target_value}" because {e}'
-                                                    )
-                                                    no_op_count += 1
-                            elif target_action == "SELECT":
-                                try:
-                                    logger.info("Try performing a SELECT")
-                                    selected_value = await select_option(
-                                        selector, target_value
                                     )
-                                    new_action = new_action.replace(
-                                        f"{target_value}", f"{selected_value}"
+                    else:
+                        no_op_count += 1
+                        target_element = []
+
+                    try:
+                        if monitor_signal == "exit":
+                            raise Exception("human supervisor manually made it exit.")
+                        if no_op_count >= max_continuous_no_op:
+                            raise Exception(
+                                f"no executable operations for {max_continuous_no_op} times."
+                            )
+                        elif time_step >= max_op:
+                            raise Exception(f"the agent reached the step limit {max_op}.")
+                        elif target_action == "TERMINATE":
+                            raise Exception("The model determined a completion.")
+
+                        # Perform browser action with PlayWright
+                        # The code is complex to handle all kinds of cases in execution
+                        # It's ugly, but it works, so far
+                        selector = None
+                        fail_to_execute = False
+                        if prepare_task is not None:
+                            await prepare_task
+                        try:
+                            if target_element == []:
+                                pass
+                            else:
+                                if not target_element in ["PRESS ENTER", "TERMINATE"]:
+                                    selector = target_element[-2]
+                                    if dev_mode:
+                                        logger.info(target_element)
+
+                            if selector:
+                                valid_op_count += 1
+                                if target_action in action_chains:
+                                    new_action, failed = await perform_action(
+                                        selector,
+                                        target_element,
+                                        target_action,
+                                        target_value,
+                                        new_action,
+                                        logger,
                                     )
-                                except Exception as e:
-                                    try:
-                                        if target_element[-1] in ["input"]:
-                                            try:
-                                                logger.info(
-                                                    'Try performing a "press_sequentially"'
-                                                )
-                                                await selector.clear(timeout=10000)
-                                                await selector.fill("", timeout=10000)
-                                                await selector.press_sequentially(
-                                                    target_value, timeout=10000
-                                                )
-                                            except Exception as e0:
-                                                await selector.fill(
-                                                    target_value, timeout=10000
-                                                )
-                                            new_action = new_action.replace(
-                                                "SELECT",
-                                                f'Failed to SELECT "{target_value}" because {e}, did a TYPE instead',
-                                            )
+                                    if failed:
+                                        no_op_count += 1
+
+                                elif target_action == "GOTO":
+                                    logger.info(f"Trying to go to {target_value}")
+                                    if not target_value.startswith("https://www."):
+                                        if target_value.startswith("www."):
+                                            target_value = "https://" + target_value
                                         else:
-                                            raise Exception(e)
-                                    except Exception as ee:
-                                        js_click = True
-                                        try:
-                                            if target_element[-1] in [
-                                                "select",
-                                                "input",
-                                            ]:
-                                                logger.info("Try performing a CLICK")
-                                                await selector.evaluate(
-                                                    "element => element.click()",
-                                                    timeout=10000,
-                                                )
-                                                js_click = False
-                                            else:
-                                                await selector.click(timeout=10000)
-                                            new_action = (
-                                                "[" + target_element[2] + "]" + " "
-                                            )
-                                            new_action += (
-                                                target_element[1]
-                                                + " -> "
-                                                + f'Failed to SELECT "{target_value}" because {e}, did a CLICK instead'
-                                            )
-                                        except Exception as eee:
-
-                                            try:
-                                                if not js_click:
-                                                    logger.info(
-                                                        "Try performing a CLICK"
-                                                    )
-                                                    await selector.evaluate(
-                                                        "element => element.click()",
-                                                        timeout=10000,
-                                                    )
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to SELECT "{target_value}" because {e}, did a CLICK instead'
-                                                    )
-                                                else:
-                                                    raise Exception(eee)
-                                            except Exception as eeee:
-                                                try:
-                                                    logger.info(
-                                                        "Try performing a HOVER"
-                                                    )
-                                                    await selector.hover(timeout=10000)
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to SELECT "{target_value}" because {e}, did a HOVER instead'
-                                                    )
-                                                except Exception as eee:
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f'Failed to SELECT "{target_value}" because {e}'
-                                                    )
-                                                    no_op_count += 1
-                            elif target_action == "HOVER":
-                                try:
-                                    logger.info("Try performing a HOVER")
-                                    await selector.hover(timeout=10000)
-                                except Exception as e:
+                                            target_value = "https://www." + target_value
+                                    logger.info(f"Now trying to go to {target_value}")
+                                    # the load event is waited for after every action below, where a timeout is not a failure
+                                    await session_control.active_page.goto(
+                                        target_value, wait_until="domcontentloaded"
+                                    )
+
+                                elif target_action == "SEARCH":
+                                    await session_control.active_page.goto(
+                                        "https://www.google.com/", wait_until="domcontentloaded"
+                                    )
+                                    elements = await get_interactive_elements_cached(
+                                        session_control.active_page
+                                    )
+                                    # one pass finds both the search box and the search button
+                                    search_element, search_button = None, None
+                                    for x in elements:
+                                        if search_element is None and "Search" in x[1] and "title" in x[1]:
+                                            search_element = x[-2]
+                                        if search_button is None and "Google Search" in x[1]:
+                                            search_button = x[-2]
+                                        if search_element is not None and search_button is not None:
+                                            break
+                                    if search_element is None:
+                                        raise IndexError("No search box on the Google page")
+                                    await search_element.press_sequentially(
+                                        target_value, timeout=10000
+                                    )
+                                    if search_button is None:
+                                        raise IndexError("No Google Search button on the Google page")
+                                    await search_button.evaluate(
+                                        "element => element.click()", timeout=10000
+                                    )
+
+                                # scroll
+                                elif target_action == "SCROLL":
+                                    logger.info(f"Scrolling {target_value}")
+                                    if target_value.lower() == "up":
+                                        await session_control.active_page.evaluate(
+                                            f"window.scrollTo(0, 0);"
+                                        )  # Scroll down 1000 pixels
+                                    else:
+                                        # scroll down three quarters of the viewport, read in the same round trip
+                                        await session_control.active_page.evaluate(
+                                            "window.scrollBy(0, Math.trunc(window.innerHeight * 0.75));"
+                                        )
+
+                                elif target_action == "GOBACK":
+                                    logger.info(f"Going back")
+                                    await session_control.active_page.go_back();
+
+                                elif target_action == "PRESS ENTER":
                                     try:
+                                        logger.info("Try performing a PRESS ENTER")
+                                        await selector.press("Enter")
+                                    except Exception as e:
                                         await selector.click(timeout=10000)
-                                        new_action = new_action.replace(
-                                            "HOVER",
-                                            f"Failed to HOVER because {e}, did a CLICK instead",
+                                        await session_control.active_page.keyboard.press(
+                                            "Enter"
                                         )
-                                    except:
-                                        js_click = True
-                                        try:
-                                            if target_element[-1] in [
-                                                "select",
-                                                "input",
-                                            ]:
-                                                logger.info("Try performing a CLICK")
-                                                await selector.evaluate(
-                                                    "element => element.click()",
-                                                    timeout=10000,
-                                                )
-                                                js_click = False
-                                            else:
-                                                await selector.click(timeout=10000)
-                                            new_action = (
-                                                "[" + target_element[2] + "]" + " "
-                                            )
-                                            new_action += (
-                                                target_element[1]
-                                                + " -> "
-                                                + f"Failed to HOVER because {e}, did a CLICK instead"
-                                            )
-                                        except Exception as eee:
-                                            try:
-                                                if not js_click:
-                                                    logger.info(
-                                                        "Try performing a CLICK"
-                                                    )
-                                                    await selector.evaluate(
-                                                        "element => element.click()",
-                                                        timeout=10000,
-                                                    )
-                                                    new_action = (
-                                                        "["
-                                                        + target_element[2]
-                                                        + "]"
-                                                        + " "
-                                                    )
-                                                    new_action += (
-                                                        target_element[1]
-                                                        + " -> "
-                                                        + f"Failed to HOVER because {e}, did a CLICK instead"
-                                                    )
-                                                else:
-                                                    raise Exception(eee)
-                                            except Exception as eeee:
-                                                new_action = (
-                                                    "[" + target_element[2] + "]" + " "
-                                                )
-                                                new_action += (
-                                                    target_element[1]
-                                                    + " -> "
-                                                    + f"Failed to HOVER because {e}"
-                                                )
-                                                no_op_count += 1
-                            elif target_action == "PRESS ENTER":
-                                try:
-                                    logger.info("Try performing a PRESS ENTER")
-                                    await selector.press("Enter")
-                                except Exception as e:
-                                    await selector.click(timeout=10000)
-                                    await session_control.active_page.keyboard.press(
-                                        "Enter"
+                            elif monitor_signal == "pause":
+                                logger.info(
+                                    "Pause for human intervention. Press Enter to continue. You can also enter your message here, which will be included in the action history as a human message."
+                                )
+                                human_intervention = await ainput()
+                                if human_intervention:
+                                    human_intervention = (
+                                        f" Human message: {human_intervention}"
                                     )
-                        elif monitor_signal == "pause":
-                            logger.info(
-                                "Pause for human intervention. Press Enter to continue. You can also enter your message here, which will be included in the action history as a human message."
-                            )
-                            human_intervention = await ainput()
-                            if human_intervention:
-                                human_intervention = (
-                                    f" Human message: {human_intervention}"
+                                raise Exception(
+                                    f"the human supervisor rejected this operation and may have taken some actions.{human_intervention}"
                                 )
-                            raise Exception(
-                                f"the human supervisor rejected this operation and may have taken some actions.{human_intervention}"
-                            )
-                        elif monitor_signal == "reject":
-                            raise Exception(
-                                "the human supervisor rejected this operation."
-                            )
-                        elif target_element == "PRESS ENTER":
-                            logger.info("Try performing a PRESS ENTER")
-                            await session_control.active_page.keyboard.press("Enter")
-                        no_op_count = 0
-                        try:
-                            await session_control.active_page.wait_for_load_state(
-                                "load"
-                            )
+                            elif monitor_signal == "reject":
+                                raise Exception(
+                                    "the human supervisor rejected this operation."
+                                )
+                            elif target_element == "PRESS ENTER":
+                                logger.info("Try performing a PRESS ENTER")
+                                await session_control.active_page.keyboard.press("Enter")
+                            no_op_count = 0
+                            try:
+                                await session_control.active_page.wait_for_load_state(
+                                    "load"
+                                )
+                            except Exception as e:
+                                pass
                         except Exception as e:
-                            pass
-                    except Exception as e:
-                        if target_action not in ["TYPE", "SELECT"]:
-                            new_action = f"Failed to {target_action} {target_element_text} because {e}"
+                            if target_action not in ["TYPE", "SELECT"]:
+                                new_action = f"Failed to {target_action} {target_element_text} because {e}"
+
+                            else:
+                                new_action = f"Failed to {target_action} {target_value} for {target_element_text} because {e}"
+                            fail_to_execute = True
+
+                        if target_element != [] or monitor_signal == "pause":
+                            # an action (or the human during a pause) can change which elements are visible
+                            # without changing the markup, e.g. a :hover menu, so the next step walks the page again
+                            session_control.interactive_elements = None
+
+                        if new_action == "" or fail_to_execute:
+                            if new_action == "":
+                                new_action = "No Operation"
+                            if monitor_signal not in ["pause", "reject"]:
+                                no_op_count += 1
+                        taken_actions.append(new_action)
+                        if not session_control.context.pages:
+                            await session_control.context.new_page()
+                            try:
+                                await session_control.active_page.set_extra_http_headers(
+                                    {"Accept-Language": "en-US"}
+                                )
+                                await session_control.active_page.goto(
+                                    confirmed_website_url, wait_until="load"
+                                )
+                            except Exception as e:
+                                pass
 
+                        if monitor_signal == "pause":
+                            pass
                         else:
-                            new_action = f"Failed to {target_action} {target_value} for {target_element_text} because {e}"
-                        fail_to_execute = True
-
-                    if new_action == "" or fail_to_execute:
-                        if new_action == "":
-                            new_action = "No Operation"
-                        if monitor_signal not in ["pause", "reject"]:
-                            no_op_count += 1
-                    taken_actions.append(new_action)
-                    if not session_control.context.pages:
-                        await session_control.context.new_page()
+                            await asyncio.sleep(3)
+                        if dev_mode:
+                            logger.info(
+                                f"current active page: {session_control.active_page}"
+                            )
+
+                            # await session_control.context.new_page()
+                            # try:
+                            #     await session_control.active_page.goto("https://www.bilibili.com/", wait_until="load")
+                            # except Exception as e:
+                            #     pass
+                            logger.info("All pages")
+                            logger.info(session_control.context.pages)
+                            logger.info("-" * 10)
                         try:
-                            await session_control.active_page.set_extra_http_headers(
-                                {"Accept-Language": "en-US"}
+                            await session_control.active_page.wait_for_load_state("load")
+                        except Exception as e:
+                            if dev_mode:
+                                logger.info(e)
+                        if tracing:
+                            logger.info("Save playwright trace file")
+                            await session_control.context.tracing.stop_chunk(
+                                path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
                             )
-                            await session_control.active_page.goto(
-                                confirmed_website_url, wait_until="load"
+                    except Exception as e:
+                        # the step stopped before its action, so the target must not be scrolled to any more
+                        await cancel_task(prepare_task)
+                        logger.info("=" * 10)
+                        logger.info(f"Decide to terminate because {e}")
+                        logger.info("Action History:")
+
+                        for action in taken_actions:
+                            logger.info(action)
+                        logger.info("")
+
+                        if tracing:
+                            logger.info("Save playwright trace file")
+                            await session_control.context.tracing.stop_chunk(
+                                path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
                             )
-                        except Exception as e:
-                            pass
 
-                    if monitor_signal == "pause":
-                        pass
-                    else:
-                        await asyncio.sleep(3)
-                    if dev_mode:
+                        success_or_not = ""
+                        if valid_op_count == 0:
+                            success_or_not = "0"
                         logger.info(
-                            f"current active page: {session_control.active_page}"
-                        )
-
-                        # await session_control.context.new_page()
-                        # try:
-                        #     await session_control.active_page.goto("https://www.bilibili.com/", wait_until="load")
-                        # except Exception as e:
-                        #     pass
-                        logger.info("All pages")
-                        logger.info(session_control.context.pages)
-                        logger.info("-" * 10)
-                    try:
-                        await session_control.active_page.wait_for_load_state("load")
-                    except Exception as e:
-                        if dev_mode:
-                            logger.info(e)
-                    if tracing:
-                        logger.info("Save playwright trace file")
-                        await session_control.context.tracing.stop_chunk(
-                            path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
-                        )
-                except Exception as e:
-                    logger.info("=" * 10)
-                    logger.info(f"Decide to terminate because {e}")
-                    logger.info("Action History:")
-
-                    for action in taken_actions:
-                        logger.info(action)
-                    logger.info("")
-
-                    if tracing:
-                        logger.info("Save playwright trace file")
-                        await session_control.context.tracing.stop_chunk(
-                            path=f"{os.path.join(main_result_path, 'playwright_traces', f'{time_step}.zip')}"
+                            f"Write results to json file: {os.path.join(main_result_path, 'result.json')}"
                         )
+                        final_json = {
+                            "confirmed_task": confirmed_task,
+                            "website": confirmed_website,
+                            "task_id": task_id,
+                            "success_or_not": success_or_not,
+                            "num_step": len(taken_actions),
+                            "action_history": taken_actions,
+                            "exit_by": str(e),
+                        }
+
+                        with open(
+                            os.path.join(main_result_path, "result.json"),
+                            "w",
+                            encoding="utf-8",
+                        ) as file:
+                            json.dump(final_json, file, indent=4)
+
+                        if monitor:
+                            logger.info(
+                                "Wait for human inspection. Directly press Enter to exit"
+                            )
+                            monitor_input = await ainput()
 
-                    success_or_not = ""
-                    if valid_op_count == 0:
-                        success_or_not = "0"
-                    logger.info(
-                        f"Write results to json file: {os.path.join(main_result_path, 'result.json')}"
-                    )
-                    final_json = {
-                        "confirmed_task": confirmed_task,
-                        "website": confirmed_website,
-                        "task_id": task_id,
-                        "success_or_not": success_or_not,
-                        "num_step": len(taken_actions),
-                        "action_history": taken_actions,
-                        "exit_by": str(e),
-                    }
-
-                    with open(
-                        os.path.join(main_result_path, "result.json"),
-                        "w",
-                        encoding="utf-8",
-                    ) as file:
-                        json.dump(final_json, file, indent=4)
-
-                    if monitor:
-                        logger.info(
-                            "Wait for human inspection. Directly press Enter to exit"
-                        )
-                        monitor_input = await ainput()
+                        logger.info("Close brownser context")
+                        close_context = session_control.context
+                        session_control.context = None
+                        await close_context.close()
 
-                    logger.info("Close brownser context")
-                    logger.removeHandler(log_fh)
-                    logger.removeHandler(console_handler)
-                    close_context = session_control.context
-                    session_control.context = None
-                    await close_context.close()
+                        complete_flag = True
+            finally:
+                # runs on every exit, so a failed step doesn't leak the file, the listener
+                # thread or the handler into the next task
+                logger.removeHandler(log_queue_handler)
+                log_listener.stop()
+                log_fh.close()
+                openai_calls_file.close()
 
-                    complete_flag = True
+    if plan_cache is not None:
+        plan_cache.close()
 
 
 if __name__ == "__main__":
@@ -1385,7 +1396,21 @@ if __name__ == "__main__":
         metavar="config",
         default=f"{os.path.join('config', 'demo_mode.toml')}",
     )
+    parser.add_argument(
+        "--num_shards",
+        help="Split the task file between this many processes (auto mode). Overrides the configuration file.",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard_id",
+        help="Which of the num_shards parts of the task file this process runs, from 0. Requires --num_shards.",
+        type=int,
+        default=None,
+    )
     args = parser.parse_args()
+    if args.shard_id is not None and args.num_shards is None:
+        parser.error("--shard_id requires --num_shards")
 
     # Load configuration file
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1408,4 +1433,8 @@ if __name__ == "__main__":
     except toml.TomlDecodeError:
         print(f"Error: File '{args.config_path}' is not a valid TOML file.")
 
+    if config is not None and args.num_shards is not None:
+        config["experiment"]["num_shards"] = args.num_shards
+        config["experiment"]["shard_id"] = args.shard_id if args.shard_id is not None else 0
+
     asyncio.run(main(config, base_dir))